@@ -0,0 +1,305 @@
+# -*- coding: utf-8 -*-
+"""
+Aggregation engine for the dashboard data.
+
+Builds the tables in csv/ (df_year, df_year_nbercat, df_20, df_20_fok_nov, the
+per-cell histograms df_20_hist_{var} behind the heatmap drill-down and the percentile
+grid df_grid_100 at the base of the multi-resolution pyramid) from the
+observation panel described in the "Data sources" tab: one row per inventor-patent
+pair, with columns appln_id, inventor_id, assignee_id, pyear, nber_cat, fok,
+log_novelty, log_cit_10, bt and fail.
+
+If the panel also has an appln_date column, the monthly and weekly tables df_month,
+df_month_nbercat, df_week and df_week_nbercat are built as well. They have the columns of
+df_year/df_year_nbercat, with pyear the start of the period as a fractional year, so
+that every granularity is drawn on the same linear axis.
+
+A synthetic panel with the same schema is provided so that the pipeline can be run,
+timed and checked without access to the raw patent data.
+
+Usage:
+    python aggregate.py panel.csv --out csv
+    python aggregate.py --synthetic --out /tmp/csv --bench
+    python aggregate.py --synthetic --check                  # bins and tables of the synthetic panel
+    python aggregate.py panel.csv --out csv --ci bootstrap   # bootstrap percentile bounds
+
+"""
+
+# imports
+import argparse
+import os
+import time
+import numpy as np
+import pandas as pd
+import bootstrap
+
+
+###########################################
+## Panel schema
+count_vars = ['inventor_id','assignee_id','appln_id']
+tie_keys = ['appln_id','inventor_id']  # unique per row: order of tied values in the quantile bins
+mean_vars = ['log_novelty','fok','bt','fail','log_cit_10']
+nber_cats = [1, 2, 3, 4, 5, 6, 9999]
+n_quantiles = 20
+hist_vars = ['log_cit_10','bt','fail']
+hist_bins = {'log_cit_10': 20, 'bt': 2, 'fail': 2}
+grid_quantiles = 100
+periods = {'month': 'M', 'week': 'W'}  # table name -> pandas period frequency
+z = 1.96  # 95% normal confidence bounds
+
+###########################################
+## Synthetic panel
+
+def synthetic_panel(n_obs=677049, seed=0):
+    """Random panel with the schema (and roughly the proportions) of the real one."""
+    rng = np.random.default_rng(seed)
+    # proportions of the real panel: 379,127 patents, 104,483 inventors, 9,945 assignees
+    n_patents = max(1, round(n_obs * 379127 / 677049))
+    n_inventors = max(1, round(n_obs * 104483 / 677049))
+    n_assignees = max(1, round(n_obs * 9945 / 677049))
+
+    # patent-level attributes
+    years = np.arange(1986, 2001)
+    p_year = np.linspace(1, 2.5, len(years))
+    p_cat = np.array([.17, .2, .11, .18, .17, .16, .01])
+    pat_year = rng.choice(years, n_patents, p=p_year / p_year.sum())
+    pat_date = (pat_year - 1970).astype('datetime64[Y]').astype('datetime64[D]') + rng.integers(0, 365, n_patents)
+    pat_cat = rng.choice(nber_cats, n_patents, p=p_cat / p_cat.sum())
+    pat_assignee = rng.integers(0, n_assignees, n_patents)
+    pat_novelty = np.log1p(rng.poisson(np.exp(-.2 - .06 * (pat_year - 1986)), n_patents))
+    pat_cit = np.log1p(rng.negative_binomial(1, .1, n_patents))
+    # patents without any new combination: a mass of log_novelty at exactly 0
+    pat_no_comb = rng.random(n_patents) < .4
+
+    # every patent has at least one inventor; co-inventors are drawn at random
+    appln = np.concatenate([np.arange(n_patents), rng.integers(0, n_patents, n_obs - n_patents)])
+    fok = rng.beta(8, 1.7, n_obs)
+    log_novelty = np.where(pat_no_comb[appln], 0, pat_novelty[appln] + rng.exponential(.3 * fok))
+    log_cit_10 = pat_cit[appln]
+    bt = (rng.random(n_obs) < .005 + .03 * fok * (log_novelty > 1)).astype(float)
+    fail = (rng.random(n_obs) < .15 + .12 * fok).astype(float)
+
+    return pd.DataFrame({'appln_id': appln,
+                         'inventor_id': rng.integers(0, n_inventors, n_obs),
+                         'assignee_id': pat_assignee[appln],
+                         'pyear': pat_year[appln],
+                         'appln_date': pat_date[appln],
+                         'nber_cat': pat_cat[appln],
+                         'fok': fok,
+                         'log_novelty': log_novelty,
+                         'log_cit_10': log_cit_10,
+                         'bt': bt,
+                         'fail': fail})
+
+###########################################
+## Aggregations
+
+def quantile_bins(x, q=n_quantiles, keys=None):
+    """Equal-frequency bins 0..q-1, as floats.
+
+    Rows are ranked by `x`, then by the columns of `keys` (a frame with the rows of `x`,
+    e.g. the `tie_keys` of the panel), then by their order. Every bin holds len(x) / q
+    rows: a large mass of tied values (e.g. log_novelty == 0) is spread over the bins it
+    spans in the order of the keys, which does not depend on the row order of the panel
+    when the keys are unique.
+    """
+    columns = [] if keys is None else [keys[c].to_numpy() for c in reversed(list(keys.columns))]
+    order = np.lexsort(columns + [np.asarray(x)])
+    ranks = np.empty(len(order))
+    ranks[order] = np.arange(len(order))
+    return np.floor(ranks * q / len(ranks))
+
+def mean_ci(panel, keys, vars=mean_vars, ci='normal'):
+    """Means of `vars` by `keys`, each followed by its `_low`/`_hi` 95% bounds (normal, or
+    bootstrap percentile bounds with ci='bootstrap')."""
+    if ci == 'bootstrap':
+        mean, low, hi = bootstrap.group_ci(panel, keys, vars, workers=os.cpu_count() or 1)
+    else:
+        g = panel.groupby(keys, sort=True)[vars]
+        mean, std, n = g.mean(), g.std(), g.count()
+        half = z * std / np.sqrt(n)
+        low, hi = mean - half, mean + half
+    cols = {}
+    for v in vars:
+        cols[v] = mean[v]
+        cols['{}_low'.format(v)] = low[v]
+        cols['{}_hi'.format(v)] = hi[v]
+    return pd.DataFrame(cols)
+
+def aggregate_counts(panel, keys, ci='normal'):
+    """Distinct patents, inventors and assignees by `keys`, followed by mean_ci."""
+    counts = panel.groupby(keys, sort=True)[count_vars].nunique()
+    return counts.join(mean_ci(panel, keys, ci=ci)).reset_index()
+
+def aggregate_year(panel, ci='normal'):
+    return aggregate_counts(panel, ['pyear'], ci=ci)
+
+def aggregate_year_nbercat(panel, ci='normal'):
+    return aggregate_counts(panel, ['pyear','nber_cat'], ci=ci)
+
+def fractional_year(dates):
+    """Dates as fractional years, e.g. 1990.0 for 1 January 1990."""
+    dates = pd.DatetimeIndex(dates)
+    return dates.year + (dates.dayofyear - 1) / np.where(dates.is_leap_year, 366, 365)
+
+def aggregate_period(panel, freq, keys=(), ci='normal'):
+    """aggregate_counts by application-date period (and `keys`), pyear being the start
+    of the period as a fractional year."""
+    start = pd.to_datetime(panel['appln_date']).dt.to_period(freq).dt.start_time
+    return aggregate_counts(panel.assign(pyear=fractional_year(start)), ['pyear'] + list(keys), ci=ci)
+
+def add_quantiles(panel, q=n_quantiles):
+    """Copy of `panel` with fok_{q} and novelty_{q} quantile bins."""
+    panel = panel.copy()
+    keys = panel[tie_keys]
+    panel['fok_{}'.format(q)] = quantile_bins(panel['fok'], q, keys)
+    panel['novelty_{}'.format(q)] = quantile_bins(panel['log_novelty'], q, keys)
+    return panel
+
+def aggregate_20(panel, q=n_quantiles):
+    """Average value (bt and fail in %) by fok x novelty quantile cell."""
+    keys = ['fok_{}'.format(q), 'novelty_{}'.format(q)]
+    df = panel.groupby(keys, sort=True)[['bt','fail','log_cit_10']].mean()
+    df[['bt','fail']] *= 100
+    return df.reset_index()
+
+def aggregate_20_fok_nov(panel, q=n_quantiles, ci='normal'):
+    """Average novelty by fok quantile, with count, std and 95% bounds."""
+    key = 'fok_{}'.format(q)
+    df = panel.groupby(key, sort=True)['log_novelty'].agg(['mean','count','std'])
+    if ci == 'bootstrap':
+        _, low, hi = bootstrap.group_ci(panel, [key], ['log_novelty'], workers=os.cpu_count() or 1)
+        df['lower'], df['upper'] = low['log_novelty'], hi['log_novelty']
+    else:
+        half = z * df['std'] / np.sqrt(df['count'])
+        df['lower'] = df['mean'] - half
+        df['upper'] = df['mean'] + half
+    return df.rename(columns={'mean': 'log_novelty'}).reset_index()
+
+def aggregate_20_hist(panel, var, q=n_quantiles):
+    """Histogram of `var` in every fok x novelty quantile cell (empty bins included):
+    one row per (fok_{q}, novelty_{q}, bin), with the bin edges and the count."""
+    nbins = hist_bins[var]
+    values = panel[var].to_numpy()
+    hi = values.max() if nbins > 2 else 1.
+    edges = np.linspace(0, hi, nbins + 1)
+    bins = np.clip(np.searchsorted(edges, values, side='right') - 1, 0, nbins - 1)
+    fok = panel['fok_{}'.format(q)].to_numpy().astype(int)
+    nov = panel['novelty_{}'.format(q)].to_numpy().astype(int)
+    counts = np.bincount((fok * q + nov) * nbins + bins, minlength=q * q * nbins)
+    cells = np.arange(q * q * nbins)
+    return pd.DataFrame({'fok_{}'.format(q): (cells // (q * nbins)).astype(float),
+                         'novelty_{}'.format(q): (cells // nbins % q).astype(float),
+                         'bin': cells % nbins,
+                         'left': edges[cells % nbins],
+                         'right': edges[cells % nbins + 1],
+                         'count': counts})
+
+def aggregate_grid(panel, q=grid_quantiles):
+    """Count and sums of the heatmap metrics (and of log_novelty and its square) in every
+    fok x novelty quantile cell, empty cells included. Unlike means, these add up, so
+    coarser grids can be derived from this one (see precompute.Data.pyramid)."""
+    fok = panel['fok_{}'.format(q)].to_numpy().astype(int)
+    nov = panel['novelty_{}'.format(q)].to_numpy().astype(int)
+    cell = fok * q + nov
+    cells = np.arange(q * q)
+    df = pd.DataFrame({'fok_{}'.format(q): (cells // q).astype(float),
+                       'novelty_{}'.format(q): (cells % q).astype(float),
+                       'count': np.bincount(cell, minlength=q * q)})
+    for var in hist_vars + ['log_novelty']:
+        df['{}_sum'.format(var)] = np.bincount(cell, weights=panel[var].to_numpy(), minlength=q * q)
+    df['log_novelty_sumsq'] = np.bincount(cell, weights=panel['log_novelty'].to_numpy() ** 2, minlength=q * q)
+    return df
+
+def build_tables(panel, timings=None, ci='normal'):
+    """All dashboard tables, keyed by their csv name (without extension), with normal or
+    bootstrap (`ci`) confidence bounds."""
+    timings = {} if timings is None else timings
+    def timed(name, f, data):
+        t0 = time.perf_counter()
+        out = f(data)
+        timings[name] = time.perf_counter() - t0
+        return out
+    tables = {}
+    tables['df_year'] = timed('df_year', lambda p: aggregate_year(p, ci), panel)
+    tables['df_year_nbercat'] = timed('df_year_nbercat', lambda p: aggregate_year_nbercat(p, ci), panel)
+    if 'appln_date' in panel:
+        for period, freq in periods.items():
+            name = 'df_{}'.format(period)
+            tables[name] = timed(name, lambda p: aggregate_period(p, freq, ci=ci), panel)
+            tables[name + '_nbercat'] = timed(name + '_nbercat', lambda p: aggregate_period(p, freq, ['nber_cat'], ci), panel)
+    panel_q = timed('quantiles', add_quantiles, panel)
+    tables['df_20'] = timed('df_20', aggregate_20, panel_q)
+    tables['df_20_fok_nov'] = timed('df_20_fok_nov', lambda p: aggregate_20_fok_nov(p, ci=ci), panel_q)
+    for var in hist_vars:
+        name = 'df_20_hist_{}'.format(var)
+        tables[name] = timed(name, lambda p: aggregate_20_hist(p, var), panel_q)
+    panel_grid = timed('quantiles_{}'.format(grid_quantiles), lambda p: add_quantiles(p, grid_quantiles), panel)
+    name = 'df_grid_{}'.format(grid_quantiles)
+    tables[name] = timed(name, aggregate_grid, panel_grid)
+    return tables
+
+def write_tables(tables, out):
+    os.makedirs(out, exist_ok=True)
+    for name, df in tables.items():
+        df.to_csv(os.path.join(out, '{}.csv'.format(name)), index=False)
+
+def check(panel, q=n_quantiles, seed=0):
+    """Check the quantile bins and the tables of `panel` (which should have tied values):
+    equal-frequency bins that do not depend on the row order, a full q x q df_20 grid, and
+    the columns of the tables shipped in csv/."""
+    from lod import require
+    binned = add_quantiles(panel, q)
+    shuffled = add_quantiles(panel.sample(frac=1, random_state=seed), q).loc[panel.index]
+    for col in ['fok_{}'.format(q), 'novelty_{}'.format(q)]:
+        sizes = binned[col].value_counts()
+        require(len(sizes) == q and sizes.max() - sizes.min() <= 1, '{} bin sizes {}'.format(col, sorted(sizes)))
+        require(binned[col].equals(shuffled[col]), '{} depends on the row order of the panel'.format(col))
+    tables = build_tables(panel)
+    require(len(tables['df_20']) == q * q, 'df_20 has {} cells, not {}'.format(len(tables['df_20']), q * q))
+    require(len(tables['df_20_fok_nov']) == q, 'df_20_fok_nov has {} rows'.format(len(tables['df_20_fok_nov'])))
+    shipped = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'csv')
+    for name in sorted(os.listdir(shipped)):
+        name = os.path.splitext(name)[0]
+        columns = list(pd.read_csv(os.path.join(shipped, name + '.csv'), nrows=0).columns)
+        require(sorted(tables[name].columns) == sorted(columns), '{} columns {} differ from csv/{}.csv'.format(
+            name, list(tables[name].columns), name))
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Build the dashboard tables from the observation panel.')
+    parser.add_argument('panel', nargs='?', help='csv with the observation panel')
+    parser.add_argument('--synthetic', action='store_true', help='use a synthetic panel instead')
+    parser.add_argument('--n-obs', type=int, default=677049, help='rows of the synthetic panel')
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--out', help='directory where the csv files are written')
+    parser.add_argument('--bench', action='store_true', help='report the time spent in each step')
+    parser.add_argument('--ci', choices=['normal','bootstrap'], default='normal', help='confidence bounds')
+    parser.add_argument('--check', action='store_true', help='check the bins and tables of the panel')
+    args = parser.parse_args()
+    if (args.panel is None) == (not args.synthetic):
+        parser.error('give either a panel csv or --synthetic')
+
+    if args.check:
+        panel = synthetic_panel(args.n_obs, seed=args.seed) if args.synthetic else pd.read_csv(args.panel)
+        check(panel, seed=args.seed)
+        print('ok: {:,} rows, {:.0%} tied log_novelty == 0'.format(len(panel), (panel['log_novelty'] == 0).mean()))
+        raise SystemExit(0)
+
+    t0 = time.perf_counter()
+    if args.synthetic:
+        panel = synthetic_panel(args.n_obs, seed=args.seed)
+    else:
+        panel = pd.read_csv(args.panel)
+    t_load = time.perf_counter() - t0
+
+    timings = {}
+    tables = build_tables(panel, timings, ci=args.ci)
+    if args.out:
+        write_tables(tables, args.out)
+    if args.bench:
+        print('{:<20}{:>10}'.format('step', 'seconds'))
+        print('{:<20}{:>10.3f}'.format('load', t_load))
+        for name, t in timings.items():
+            print('{:<20}{:>10.3f}'.format(name, t))
+        print('{:<20}{:>10.3f}  ({:,} rows)'.format('total', sum(timings.values()), len(panel)))
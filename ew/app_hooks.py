@@ -0,0 +1,42 @@
+# -*- coding: utf-8 -*-
+"""
+Server lifecycle hooks of the bokeh application.
+
+on_server_loaded runs once per server process, before any session is created: it
+refreshes the columnar cache of the csv tables of the default dataset and builds its
+process-wide frames in precompute.py, so that sessions only construct their figures.
+With several workers (serve.py), this was already done before the fork and the workers
+share the data. It also sets the log level of the application's modules to INFO, and
+starts the metrics reporting of instrument.py when EW_METRICS is set and the admin
+endpoints of lifecycle.py when EW_ADMIN_TOKEN is set.
+on_session_destroyed forgets closed sessions, whose documents the server has released.
+
+"""
+
+import logging
+import instrument
+import lifecycle
+import precompute
+
+
+def preload():
+    """Refresh the cache and build every process-wide frame of the default dataset (the
+    others are loaded when a session first selects them). Cheap once done: serve.py calls
+    it before forking the workers, which then inherit the loaded data (precompute.load
+    times the data_load section only when it actually reads the tables)."""
+    precompute.load()
+
+def configure_logging(level=logging.INFO):
+    """Log the modules of the application at `level`: bokeh serve only sets the level of
+    its own loggers, and the root logger stays at WARNING."""
+    for module in (instrument, lifecycle, precompute):
+        module.log.setLevel(level)
+
+def on_server_loaded(server_context):
+    configure_logging()
+    preload()
+    instrument.start(server_context)
+    lifecycle.start(server_context)
+
+def on_session_destroyed(session_context):
+    lifecycle.session_destroyed(session_context.id)
@@ -0,0 +1,275 @@
+# -*- coding: utf-8 -*-
+"""
+Headless benchmark of session-document construction.
+
+Runs the on_server_loaded hook once, then builds each of the five tabs (and the whole
+layout, eager and lazy) in a fresh Document `--repeat` times, without a browser or a
+server. Reports the median build time, the number of models and the size of the
+serialized document, i.e. the JSON a browser receives when a session opens, plus the
+time to build each lazy tab when it is first activated and the latency and patch size of
+the Tab II filters, the Tab I/II granularity switches (when the monthly and weekly tables
+are available), the Tab III drill-down and the dataset switch (when several datasets are
+registered). For each quantile resolution of the Tab III pyramid it reports the switch
+time, its patch size and the size of the resulting document (browser render time is out
+of reach of a headless benchmark).
+
+Usage:
+    python bench.py                           # print the table
+    python bench.py --json bench.json         # also save the results
+    python bench.py --baseline bench.json     # compare against saved results
+    python bench.py --check                   # fail if more than Tab I is built at session start,
+                                              # or if switching datasets leaves stale names
+
+"""
+
+# imports
+import argparse
+import collections
+import glob
+import json
+import os
+import shutil
+import statistics
+import tempfile
+import time
+import pandas as pd
+from bokeh.document import Document
+from bokeh.models import Title
+from bokeh.models.widgets import Tabs
+import app_hooks
+import dashboard
+import instrument
+import precompute
+import registry
+from lod import require
+
+
+def measure(build, repeat):
+    times = []
+    for _ in range(repeat):
+        doc = Document()
+        t0 = time.perf_counter()
+        doc.add_root(build())
+        times.append(time.perf_counter() - t0)
+    t0 = time.perf_counter()
+    payload = doc.to_json_string()
+    t_json = time.perf_counter() - t0
+    return {'build_ms': statistics.median(times) * 1e3,
+            'json_ms': t_json * 1e3,
+            'models': count_models(doc.roots[0]),
+            'bytes': len(payload.encode('utf-8'))}
+
+def measure_activation(repeat):
+    """Median time to build each lazy tab when the user first switches to it."""
+    times = {i: [] for i in range(1, len(dashboard.tab_builders))}
+    for _ in range(repeat):
+        doc = Document()
+        doc.add_root(dashboard.layout())
+        tabs = doc.roots[0].children[1]
+        for i in times:
+            t0 = time.perf_counter()
+            tabs.active = i
+            times[i].append(time.perf_counter() - t0)
+    return {'activate_{}'.format(dashboard.tab_builders[i].__name__): statistics.median(t) * 1e3
+            for i, t in times.items()}
+
+def measure_interactions(repeat):
+    """Median latency and patch size of the Tab II filters, the granularity switches, the
+    Tab III drill-down and the dataset switch callbacks."""
+    instrument.history.clear()
+    ncats = len(precompute.nbercats())
+    for _ in range(repeat):
+        doc = Document()
+        doc.add_root(dashboard.layout())
+        tabs = doc.roots[0].children[1]
+        tabs.active = 1
+        category_filter = doc.select_one({'name': 'category_filter'})
+        category_filter.active = list(range(1, ncats))
+        category_filter.active = list(range(ncats))
+        # value_throttled is read-only on the python side; fire its callbacks as the browser would
+        year_filter = doc.select_one({'name': 'year_filter'})
+        year_filter.trigger('value_throttled', year_filter.value, (1990, 1995))
+        # finest granularity and back; also times the level of detail of each tab
+        for name in ['overview_granularity', 'nbercat_granularity']:
+            select = doc.select_one({'name': name})
+            if select is not None:
+                select.value = select.options[-1]
+                select.value = select.options[0]
+        tabs.active = 2
+        if precompute.hist_index() is not None:
+            source_df_20 = doc.select_one({'name': 'source_df_20'})
+            source_df_20.selected.indices = [0]
+            source_df_20.selected.indices = [1]
+        # another registered dataset and back, with Tabs I-III built
+        select = doc.select_one({'name': 'dataset_select'})
+        if select is not None:
+            select.value = select.options[-1][0]
+            select.value = select.options[0][0]
+    return {name: {'ms': statistics.median(r.ms for r in records),
+                   'bytes': statistics.median(r.bytes for r in records)}
+            for name, records in instrument.history.items()}
+
+def measure_resolutions(repeat):
+    """Switch time, patch size and document size of Tab III at each pyramid resolution."""
+    results = {}
+    for q in sorted(precompute.pyramid()):
+        times, patches = [], []
+        for _ in range(repeat):
+            doc = Document()
+            doc.add_root(Tabs(tabs=[dashboard.tab_fok_novelty()]))
+            select = doc.select_one({'name': 'resolution_select'})
+            if select is not None and select.value != str(q):
+                instrument.history.clear()
+                t0 = time.perf_counter()
+                select.value = str(q)
+                times.append(time.perf_counter() - t0)
+                patches.append(instrument.history['heatmap_resolution'][-1].bytes)
+        results['resolution_{}'.format(q)] = {'switch_ms': statistics.median(times) * 1e3 if times else 0,
+                                              'patch_bytes': statistics.median(patches) if patches else 0,
+                                              'models': count_models(doc.roots[0]),
+                                              'bytes': len(doc.to_json_string().encode('utf-8'))}
+    return results
+
+def count_models(root):
+    return len(root.references())
+
+def check_initial_models():
+    """The lazy layout must start with the models of Tab I only, and end up with the
+    same models as the eager layout once every tab has been activated."""
+    n_tabs = len(dashboard.tab_builders)
+    doc = Document()
+    doc.add_root(dashboard.layout())
+    initial = count_models(doc.roots[0])
+    # column, heading (and dataset selector), Tabs and Tab I, plus a Panel and a placeholder
+    # Div for each other tab
+    top = doc.roots[0].children[0]
+    expected = 2 + count_models(top) + count_models(dashboard.tab_overview()) + 2 * (n_tabs - 1)
+    require(initial == expected, 'session starts with {} models, expected {}'.format(initial, expected))
+    tabs = doc.roots[0].children[1]
+    for i in range(1, n_tabs):
+        tabs.active = i
+    eager = count_models(dashboard.layout(lazy=False))
+    require(count_models(doc.roots[0]) == eager, 'all tabs activated: {} models, eager layout has {}'.format(
+        count_models(doc.roots[0]), eager))
+    return initial, eager
+
+def dataset_variants(folder):
+    """Copies of the default dataset registered under other names: one whose confidence
+    bound columns have other suffixes, one whose metric and category labels differ."""
+    base = registry.get()
+    suffixes = base._replace(name='check-suffixes', csv_dir=os.path.join(folder, 'csv'),
+                             cache_dir=os.path.join(folder, 'cache-suffixes'), ci=('_lower', '_upper'))
+    renamed = {}
+    for var in base.metrics:
+        renamed.update(zip(registry.bounds(base, var), registry.bounds(suffixes, var)))
+    os.mkdir(suffixes.csv_dir)
+    for path in glob.glob(os.path.join(base.csv_dir, '*.csv')):
+        pd.read_csv(path).rename(columns=renamed).to_csv(os.path.join(suffixes.csv_dir, os.path.basename(path)),
+                                                         index=False)
+    labels = base._replace(
+        name='check-labels', cache_dir=os.path.join(folder, 'cache-labels'),
+        metrics=collections.OrderedDict((var, 'Other ' + l) for var, l in base.metrics.items()),
+        short_labels={var: 'Other ' + l for var, l in base.short_labels.items()},
+        categories=collections.OrderedDict((code, 'Other ' + l) for code, l in base.categories.items()))
+    return [suffixes, labels]
+
+def check_dataset_swaps():
+    """Switching a session with every tab built to a dataset whose bound suffixes or labels
+    differ must not fail, and must leave the figure titles and category labels of the new
+    dataset; then back to the default one."""
+    folder = tempfile.mkdtemp()
+    variants = dataset_variants(folder)
+    base = registry.get()
+    try:
+        for variant in variants:
+            registry.datasets[variant.name] = variant
+            doc = Document()
+            doc.add_root(dashboard.layout())
+            tabs = doc.roots[0].children[1]
+            for i in range(1, len(dashboard.tab_builders)):
+                tabs.active = i
+            select = doc.select_one({'name': 'dataset_select'})
+            for dataset in (variant, base):
+                select.value = dataset.name
+                titles = {title.text for title in doc.select({'type': Title})}
+                expected = {registry.label(dataset, var, short) for var in dataset.metrics for short in (False, True)}
+                require(expected <= titles, 'switched to {}: titles {} missing'.format(
+                    dataset.name, sorted(expected - titles)))
+                nbercats = precompute.nbercats(dataset.name)
+                expected = [dataset.categories.get(nbercat, str(nbercat)) for nbercat in nbercats]
+                labels = doc.select_one({'name': 'category_filter'}).labels
+                require(labels == expected, 'switched to {}: category labels {}'.format(dataset.name, labels))
+            del registry.datasets[variant.name]
+    finally:
+        for variant in variants:
+            registry.datasets.pop(variant.name, None)
+            precompute.loaded.pop(variant.name, None)
+        shutil.rmtree(folder)
+    return [variant.name for variant in variants]
+
+def run(repeat):
+    results = {}
+    for build in dashboard.tab_builders:
+        results[build.__name__] = measure(lambda: Tabs(tabs=[build()]), repeat)
+    results['layout_eager'] = measure(lambda: dashboard.layout(lazy=False), repeat)
+    results['layout'] = measure(dashboard.layout, repeat)
+    return results
+
+def report(results, baseline=None):
+    cols = ['build_ms', 'json_ms', 'models', 'bytes']
+    print('{:<18}'.format('') + ''.join('{:>14}'.format(c) for c in cols))
+    for name, r in results.items():
+        line = '{:<18}'.format(name)
+        for c in cols:
+            cell = '{:.1f}'.format(r[c]) if c.endswith('_ms') else '{:,}'.format(r[c])
+            if baseline and name in baseline and baseline[name][c]:
+                cell += ' {:+.0f}%'.format(100 * (r[c] / baseline[name][c] - 1))
+            line += '{:>14}'.format(cell)
+        print(line)
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Benchmark the construction of a session document.')
+    parser.add_argument('--repeat', type=int, default=20)
+    parser.add_argument('--json', help='save the results to this file')
+    parser.add_argument('--baseline', help='results file to compare against')
+    parser.add_argument('--check', action='store_true', help='only check the models built at session start')
+    args = parser.parse_args()
+
+    # patch sizes are only measured with metrics enabled
+    instrument.enabled = True
+    t0 = time.perf_counter()
+    app_hooks.on_server_loaded(None)
+    print('on_server_loaded: {:.1f} ms (once per process)\n'.format((time.perf_counter() - t0) * 1e3))
+
+    if args.check:
+        initial, eager = check_initial_models()
+        print('ok: {} models at session start ({} with every tab built)'.format(initial, eager))
+        print('ok: dataset switches to {}'.format(', '.join(check_dataset_swaps())))
+        raise SystemExit(0)
+
+    results = run(args.repeat)
+    activation = measure_activation(args.repeat)
+    interactions = measure_interactions(args.repeat)
+    resolutions = measure_resolutions(args.repeat)
+    baseline = None
+    if args.baseline:
+        with open(args.baseline) as f:
+            baseline = json.load(f)
+    report(results, baseline)
+    print()
+    for name, ms in activation.items():
+        print('{:<28}{:>10.1f} ms'.format(name, ms))
+    results['activation_ms'] = activation
+    print()
+    for name, r in interactions.items():
+        print('{:<28}{:>10.1f} ms{:>10,.0f} bytes patch'.format(name, r['ms'], r['bytes']))
+    results['interactions'] = interactions
+    print()
+    for name, r in resolutions.items():
+        print('{:<28}{:>10.1f} ms{:>12,.0f} bytes patch{:>12,} bytes document'.format(
+            name, r['switch_ms'], r['patch_bytes'], r['bytes']))
+    results['resolutions'] = resolutions
+    if args.json:
+        with open(args.json, 'w') as f:
+            json.dump(results, f, indent=1)
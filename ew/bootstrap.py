@@ -0,0 +1,287 @@
+# -*- coding: utf-8 -*-
+"""
+Bootstrap percentile confidence intervals for the whisker bounds.
+
+The `_low`/`_hi` (and `lower`/`upper`) columns of the tables are normal 95% bounds
+computed by aggregate.py. This module computes percentile bootstrap bounds instead, for
+any cut of the observation panel: means by year, year x category or quantile cell,
+optionally on a subset of the rows (e.g. some categories or a year window).
+
+Resampling is vectorized. Discrete variables (bt and fail, but also the log counts
+log_novelty and log_cit_10) in large enough groups are not resampled row by row: the
+bootstrap distribution of a group mean is then a multinomial draw of the counts of each
+value in the group, made for every group at once. Other variables are resampled from
+rows sorted by group: each replicate draws one row per row within its own group and sums
+every group with a single reduceat. Replicates are split in fixed-size chunks, each
+seeded by its own child of a SeedSequence and run on a process pool, so results only
+depend on the seed, never on the number of workers.
+
+For interactive use, Bootstrap keeps one process pool for its lifetime, each worker
+holding the panel from its start: a cut then only sends its key and seeds to the
+workers, which select and sort its rows themselves. Its memo of intervals is bounded
+(least recently used cuts are dropped first).
+
+Usage:
+    python bootstrap.py                  # benchmark on the synthetic panel
+    python bootstrap.py --workers 4      # ... with 4 processes
+    python bootstrap.py --check          # check determinism and agreement with normal bounds
+
+"""
+
+# imports
+import argparse
+import collections
+import concurrent.futures
+import os
+import time
+import numpy as np
+import pandas as pd
+
+
+###########################################
+## Parameters
+n_boot = 1000
+alpha = .05  # 95% intervals
+chunk_size = 100  # replicates per task; fixed so that results do not depend on the pool size
+max_cached = 256  # intervals memoized by a Bootstrap
+# a multinomial draw costs about this many resampled rows per value and group; discrete
+# variables are drawn as multinomials when that is cheaper than resampling their rows
+multinomial_cost = 5
+groupings = {'year': ['pyear'],
+             'year_nbercat': ['pyear','nber_cat'],
+             'fok': ['fok_20'],
+             'cell': ['fok_20','novelty_20']}
+
+###########################################
+## Resampling
+
+# rows sorted by group, set by _init (once per pool, or per cut in a Bootstrap's workers)
+_sorted = {}
+# the panel of a Bootstrap's worker process, set once by _init_panel
+_panel = {}
+
+def cut(panel, keys, vars, rows=()):
+    """Values of `vars` (rows x vars) and group codes by `keys` of the rows of `panel` whose
+    columns have the values in `rows` ((column, values) pairs), plus the index of the groups."""
+    for col, values in rows:
+        panel = panel[panel[col].isin(values)]
+    g = panel.groupby(list(keys), sort=True)
+    return panel[list(vars)].to_numpy(dtype=float), g.ngroup().to_numpy(), g.size().index
+
+def _by_group(values, codes):
+    """`values` sorted by group, the start and size of every group."""
+    order = np.argsort(codes, kind='stable')
+    counts = np.bincount(codes, minlength=codes.max() + 1)
+    starts = np.concatenate([[0], np.cumsum(counts)[:-1]])
+    return values[order], starts, counts
+
+def _init_panel(panel):
+    _panel['panel'] = panel
+
+def _resample_cut(key, columns, seed, n):
+    """_resample in a Bootstrap's worker: the columns `columns` of the cut `key` (keys,
+    vars, rows) of its panel, sorted by group the first time the cut is asked for."""
+    if _sorted.get('cut') != (key, columns):
+        values, codes, _ = cut(_panel['panel'], *key)
+        sorted_values, starts, counts = _by_group(values[:, list(columns)], codes)
+        _init(sorted_values, starts, counts)
+        _sorted['cut'] = key, columns
+    return _resample(seed, n)
+
+def _init(values, starts, counts):
+    _sorted.pop('cut', None)
+    _sorted['values'] = [np.ascontiguousarray(v) for v in np.nan_to_num(values).T]
+    _sorted['valid'] = None if not np.isnan(values).any() else (~np.isnan(values)).astype(float)
+    _sorted['starts'] = starts
+    _sorted['counts'] = counts
+    _sorted['first'] = np.repeat(starts, counts)
+    _sorted['size'] = np.repeat(counts, counts)
+
+def _resample(seed, n):
+    """Means of `n` replicates of every group, (n, groups, vars), NaN where a group has no value."""
+    rng = np.random.default_rng(seed)
+    values, valid, starts = _sorted['values'], _sorted['valid'], _sorted['starts']
+    out = np.empty((n, len(starts), len(values)))
+    for b in range(n):
+        rows = _sorted['first'] + (rng.random(len(_sorted['first'])) * _sorted['size']).astype(np.intp)
+        trials = _sorted['counts'] if valid is None else np.add.reduceat(valid[rows], starts).T
+        with np.errstate(invalid='ignore', divide='ignore'):
+            for j, v in enumerate(values):
+                out[b, :, j] = np.add.reduceat(v[rows], starts) / (trials if valid is None else trials[j])
+    return out
+
+def _multinomial(seed, n, counts, levels):
+    """Means of `n` replicates of every group of a discrete variable whose values `levels`
+    occur `counts` (groups x levels) times in each group."""
+    rng = np.random.default_rng(seed)
+    trials = counts.sum(axis=1)
+    with np.errstate(invalid='ignore', divide='ignore'):
+        pvals = np.nan_to_num(counts / trials[:, None])
+        return rng.multinomial(trials, pvals, size=(n, len(trials))) @ levels / trials
+
+def percentile_ci(values, codes, n_boot=n_boot, seed=0, workers=1, pool=None, key=None):
+    """Means and bootstrap percentile bounds of the columns of `values` (rows x vars) in the
+    groups `codes` (0..groups-1, every group non-empty): three (groups, vars) arrays.
+
+    With a Bootstrap's `pool`, its workers resample the cut `key` of their own panel
+    (`values` and `codes` being that cut) instead of receiving the rows.
+    """
+    values = np.asarray(values, dtype=float).reshape(len(codes), -1)
+    sizes = [min(chunk_size, n_boot - i) for i in range(0, n_boot, chunk_size)]
+    seeds = np.random.SeedSequence(seed).spawn(len(sizes))
+    n_groups = codes.max() + 1
+    reps = np.empty((n_boot, n_groups, values.shape[1]))
+    mean = np.empty((n_groups, values.shape[1]))
+    continuous = []
+    for j in range(values.shape[1]):
+        valid = ~np.isnan(values[:, j])
+        levels, inverse = np.unique(values[valid, j], return_inverse=True)
+        if len(levels) * n_groups * multinomial_cost > len(values):
+            continuous.append(j)
+            continue
+        counts = np.bincount(codes[valid] * len(levels) + inverse, minlength=n_groups * len(levels))
+        counts = counts.reshape(n_groups, len(levels))
+        with np.errstate(invalid='ignore', divide='ignore'):
+            mean[:, j] = counts @ levels / counts.sum(axis=1)
+        reps[..., j] = np.concatenate([_multinomial(s, n, counts, levels) for s, n in zip(seeds, sizes)])
+    if continuous:
+        sorted_values, starts, counts = _by_group(values[:, continuous], codes)
+        with np.errstate(invalid='ignore', divide='ignore'):
+            mean[:, continuous] = (np.add.reduceat(np.nan_to_num(sorted_values), starts)
+                                   / np.add.reduceat(~np.isnan(sorted_values), starts))
+        initargs = (sorted_values, starts, counts)
+        if pool is not None:
+            tasks = len(sizes)
+            parts = list(pool.map(_resample_cut, [key] * tasks, [tuple(continuous)] * tasks, seeds, sizes))
+        elif workers == 1:
+            _init(*initargs)
+            parts = [_resample(s, n) for s, n in zip(seeds, sizes)]
+        else:
+            with concurrent.futures.ProcessPoolExecutor(workers, initializer=_init, initargs=initargs) as pool:
+                parts = list(pool.map(_resample, seeds, sizes))
+        reps[..., continuous] = np.concatenate(parts)
+    percentile = np.nanpercentile if np.isnan(reps).any() else np.percentile
+    low, hi = percentile(reps, [100 * alpha / 2, 100 * (1 - alpha / 2)], axis=0)
+    return mean, low, hi
+
+def group_ci(panel, keys, vars, n_boot=n_boot, seed=0, workers=1):
+    """Means of `vars` by `keys` with their bootstrap bounds, as three frames indexed by `keys`
+    (the layout of a pandas groupby mean)."""
+    values, codes, index = cut(panel, keys, vars)
+    arrays = percentile_ci(values, codes, n_boot=n_boot, seed=seed, workers=workers)
+    return [pd.DataFrame(a, index=index, columns=vars) for a in arrays]
+
+###########################################
+## Memoized cuts
+
+class Bootstrap:
+    """Bootstrap bounds of cuts of an observation panel, memoized per (metrics, grouping, filter).
+
+    `grouping` is a key of `groupings` (quantile cells need the fok_20/novelty_20 columns
+    of aggregate.add_quantiles) or a list of columns; `filter` maps columns to the values
+    to keep, e.g. {'nber_cat': [1, 2], 'pyear': range(1990, 1996)}. The last `max_cached`
+    intervals asked for are memoized. With several workers, the process pool is started
+    by the first interval that needs it and kept until `close`.
+    """
+
+    def __init__(self, panel, n_boot=n_boot, seed=0, workers=None, max_cached=max_cached):
+        self.panel = panel
+        self.n_boot = n_boot
+        self.seed = seed
+        self.workers = workers or os.cpu_count() or 1
+        self.max_cached = max_cached
+        self.cache = collections.OrderedDict()
+        self.pool = None
+
+    def close(self):
+        """Stop the worker processes."""
+        if self.pool is not None:
+            self.pool.shutdown()
+            self.pool = None
+
+    @staticmethod
+    def key(metrics, grouping, filter=None):
+        keys = groupings.get(grouping, grouping) if isinstance(grouping, str) else grouping
+        rows = tuple(sorted((col, tuple(sorted(values))) for col, values in (filter or {}).items()))
+        return tuple(metrics), tuple(keys), rows
+
+    def interval(self, metrics, grouping, filter=None):
+        """Frame with the grouping columns and, for every metric, its mean and `_low`/`_hi` bounds."""
+        key = self.key(metrics, grouping, filter)
+        if key in self.cache:
+            self.cache.move_to_end(key)
+        else:
+            metrics, keys, rows = key
+            if self.pool is None and self.workers > 1:
+                self.pool = concurrent.futures.ProcessPoolExecutor(self.workers, initializer=_init_panel,
+                                                                   initargs=(self.panel,))
+            values, codes, index = cut(self.panel, keys, metrics, rows)
+            arrays = percentile_ci(values, codes, n_boot=self.n_boot, seed=self.seed, workers=self.workers,
+                                   pool=self.pool, key=(keys, metrics, rows))
+            mean, low, hi = [pd.DataFrame(a, index=index, columns=list(metrics)) for a in arrays]
+            cols = {}
+            for v in metrics:
+                cols[v] = mean[v]
+                cols['{}_low'.format(v)] = low[v]
+                cols['{}_hi'.format(v)] = hi[v]
+            self.cache[key] = pd.DataFrame(cols).reset_index()
+            if len(self.cache) > self.max_cached:
+                self.cache.popitem(last=False)
+        return self.cache[key]
+
+
+if __name__ == '__main__':
+    import aggregate
+    from lod import require
+
+    parser = argparse.ArgumentParser(description='Benchmark or check the bootstrap intervals.')
+    parser.add_argument('--n-obs', type=int, default=677049, help='rows of the synthetic panel')
+    parser.add_argument('--n-boot', type=int, default=n_boot)
+    parser.add_argument('--workers', type=int, default=os.cpu_count() or 1)
+    parser.add_argument('--check', action='store_true')
+    args = parser.parse_args()
+
+    panel = aggregate.add_quantiles(aggregate.synthetic_panel(args.n_obs))
+
+    if args.check:
+        vars = ['log_novelty','bt']
+        one = group_ci(panel, ['pyear'], vars, n_boot=200, seed=1, workers=1)
+        two = group_ci(panel, ['pyear'], vars, n_boot=200, seed=1, workers=2)
+        require(all(a.equals(b) for a, b in zip(one, two)), 'results depend on the number of workers')
+        normal = aggregate.mean_ci(panel, ['pyear'], vars)
+        mean, low, hi = one
+        for v in vars:
+            require(np.allclose(mean[v], normal[v]), '{}: means differ from aggregate.mean_ci'.format(v))
+            require(np.all(low[v] < mean[v]) and np.all(mean[v] < hi[v]), '{}: bounds around the means'.format(v))
+            # large groups: the percentile bounds are close to the normal ones
+            width = normal['{}_hi'.format(v)] - normal['{}_low'.format(v)]
+            require(np.allclose(hi[v] - low[v], width, rtol=.25), '{}: bounds far from the normal ones'.format(v))
+        # the persistent pool gives the same intervals as a single process, and the memo is bounded
+        filter = {'nber_cat': [1, 2]}
+        single = Bootstrap(panel, n_boot=200, seed=1, workers=1)
+        pooled = Bootstrap(panel, n_boot=200, seed=1, workers=2, max_cached=2)
+        try:
+            for grouping in ['year', 'fok', 'year_nbercat']:
+                require(single.interval(vars, grouping, filter).equals(pooled.interval(vars, grouping, filter)),
+                        '{}: intervals depend on the pool'.format(grouping))
+            require(len(pooled.cache) == 2, 'memo holds {} intervals'.format(len(pooled.cache)))
+        finally:
+            pooled.close()
+        print('ok')
+        raise SystemExit(0)
+
+    boot = Bootstrap(panel, n_boot=args.n_boot, workers=args.workers)
+    cuts = [('year', None), ('year_nbercat', None), ('cell', None),
+            ('year_nbercat', {'nber_cat': [1, 2], 'pyear': range(1990, 1996)})]
+    print('{:,} rows, {} replicates, {} workers'.format(len(panel), args.n_boot, boot.workers))
+    for grouping, filter in cuts:
+        for metrics in [aggregate.mean_vars, ['bt','fail']]:
+            t0 = time.perf_counter()
+            boot.interval(metrics, grouping, filter)
+            t_first = time.perf_counter() - t0
+            t0 = time.perf_counter()
+            boot.interval(metrics, grouping, filter)
+            t_cached = time.perf_counter() - t0
+            print('{:<14}{:<10}{:<26}{:>10.3f} s{:>10.3f} ms cached'.format(
+                grouping, 'filtered' if filter else '', ','.join(metrics), t_first, t_cached * 1e3))
+    boot.close()
@@ -0,0 +1,683 @@
+# -*- coding: utf-8 -*-
+"""
+Created on Wed Feb 26 09:59:38 1021
+
+@author: Manuel G.
+
+This script uses bokeh to create an interactive dashboard to explore the data from my working paper:
+"Enchanted wanderer or stone guest? On field-original knowledge and the creativity of invention"
+
+The data is loaded and pre-aggregated once per process (see app_hooks.py and precompute.py);
+the functions below only build the models of a session's document. Metrics, labels and
+categories come from the dataset's entry in registry.py. When several datasets are
+registered, a selector switches the session to another one: if its structure (columns
+and labels, see Data.structure) matches, each built tab loads the new data into its
+existing models, otherwise the built tabs are rebuilt (the rest of the document stays).
+
+"""
+
+# imports
+import math
+import numpy as np
+from bokeh.plotting import ColumnDataSource, figure
+from bokeh.palettes import d3, turbo, Viridis256
+from bokeh.models.mappers import LinearColorMapper
+from bokeh.models import BasicTicker, ColorBar, Range1d, HoverTool,Whisker, TapTool
+from bokeh.layouts import column, row, gridplot
+from bokeh.models.widgets import Panel, Tabs, CheckboxGroup, RangeSlider, Select
+from bokeh.models.widgets.markups import Div
+import instrument
+import lod
+import precompute
+import registry
+
+
+###########################################
+# Palettes
+def colors(n):
+    """`n` categorical colors: Category10 or Category20, then colors spread over turbo
+    beyond the 20 colors of Category20."""
+    if n <= 10:
+        return d3['Category10'][10][:n]
+    return d3['Category20'][20][:n] if n <= 20 else turbo(n)
+
+tools_to_show = 'hover,box_zoom,pan,save,reset,wheel_zoom'
+textbox_height = 100
+image_threshold = 20  # heatmaps with more bins per side are drawn as images
+quantile_names = {5: 'Quintiles', 10: 'Deciles', 20: 'Ventiles', 100: 'Percentiles'}
+title = 'Enchanted Wanderer or Stone Guest?'
+tab_titles = ['I. Overview',
+              'II. Overview by technology sectors',
+              'III. Field-original knowledge, novelty and the value of invention',
+              'IV. Data sources and main variables',
+              'V. Abstract']
+
+###########################################
+## Dashboad proper
+###########################################
+
+def y_bounds(data, lows, his):
+    """y range enclosing the confidence bounds in the columns `lows` and `his` of `data`."""
+    return (np.nanmin([np.nanmin(data[c]) for c in lows]) * .98,
+            np.nanmax([np.nanmax(data[c]) for c in his]) * 1.02)
+
+def quantiles(k, of):
+    """Axis label of `k` quantile bins of `of`."""
+    return '{} of {}'.format(quantile_names.get(k, '{}-quantiles'.format(k)), of)
+
+def fit_y(y_ranges, data):
+    """Refit the bounds of the (range, lows, his) tuples in `y_ranges` to `data` with y_bounds."""
+    for y_range, lows, his in y_ranges:
+        y_range.start, y_range.end = y_bounds(data, lows, his)
+
+def granularity_select(detail, options, columns, y_ranges, name):
+    """Select of the time granularity of a tab's charts.
+
+    `columns(option)` gives the columns of an option, which replace the full-resolution
+    data of the LevelOfDetail `detail`; the `y_ranges` are refitted to them with fit_y.
+    """
+    select = Select(title='Granularity', value=options[0], options=options, width=120, name=name)
+
+    def on_granularity(attr, old, new):
+        with instrument.interaction(select, name):
+            data = columns(new)
+            fit_y(y_ranges, data)
+            detail.set_data(data)
+
+    select.on_change('value', on_granularity)
+    return select
+
+### Tab I: Overview
+
+def tab_overview(server=True, data=None, swaps=None):
+    data = data or precompute.load()
+    dataset = data.dataset
+    palette = colors(len(dataset.counts) + len(dataset.metrics))
+
+    # Figure 1_a: line plot with patent counts
+    var = list(dataset.counts)
+    varnames = [registry.label(dataset, v) for v in var]
+    color = palette[:len(var)]
+
+    # one source for every figure of the tab
+    columns = data.table_data('df_year')
+    source_counts_class_pyear = ColumnDataSource(data=columns)
+    fig_1_a = figure(title='Evolution',
+                     x_axis_label='Year',
+                     plot_width=1000,
+                     plot_height=300)
+    plots = []
+    for i in range(len(var)):
+        fig_1_a.line(x='pyear', y=var[i],
+                     source=source_counts_class_pyear,
+                     legend_label=varnames[i],
+                     color=color[i])
+        plots.append(fig_1_a.circle(x='pyear',y=var[i],
+                                    source=source_counts_class_pyear,
+                                    size=10,
+                                    fill_color=color[i],
+                                    line_color='white',
+                                    alpha=.1,
+                                    hover_fill_color=color[i], hover_alpha=.5, hover_line_color='white'))
+        fig_1_a.add_tools(HoverTool(renderers=[plots[i]],
+                                    tooltips=[('Year','@pyear'),(varnames[i], '@{}'.format(var[i]))],
+                                    mode='mouse'))
+    fig_1_a.legend.location='top_left'
+
+    # Figures 1_b - 1_f: the first two metrics, then the outcomes
+    var = list(dataset.metrics)
+    varnames = [registry.label(dataset, v, short=True) for v in var]
+    plot_size = [(round(1000/len(r)),200) for r in (var[:2], var[2:]) for _ in r]
+    color = palette[len(dataset.counts):]
+    plots = []
+    y_ranges = []
+    for i in range(len(var)):
+        plots.append(figure(title=varnames[i],
+                            x_axis_label='Year',
+                            plot_width=plot_size[i][0],
+                            plot_height=plot_size[i][1]))
+        low, hi = registry.bounds(dataset, var[i])
+        plots[i].y_range=Range1d(*y_bounds(columns, [low], [hi]))
+        y_ranges.append((plots[i].y_range, [low], [hi]))
+        plots[i].line(x='pyear', y=var[i],
+                      source=source_counts_class_pyear,
+                      color=color[i])
+        w = Whisker(source=source_counts_class_pyear,
+                    base="pyear", upper=hi,
+                    lower=low,
+                    level="overlay",
+                    line_color=color[i])
+        w.upper_head.line_color = color[i]
+        w.lower_head.line_color = color[i]
+        plots[i].add_layout(w)
+        plots[i].add_tools(HoverTool(tooltips=[('Year','@pyear'),(varnames[i], '@{}'.format(var[i]))],
+                                     mode='vline'))
+    for fig in plots:
+        fig.x_range = fig_1_a.x_range
+
+    # Granularity: monthly and weekly data go through a level of detail that only sends the
+    # points of the visible years, at screen resolution (see lod.py)
+    controls = []
+    detail = None
+    granularities = data.available_granularities()
+    if server and len(granularities) > 1:
+        detail = lod.LevelOfDetail(source_counts_class_pyear, fig_1_a.x_range, name='overview_lod')
+        detail.attach(fig_1_a, *plots)
+        controls = [granularity_select(detail, list(granularities), lambda label: data.table_data(granularities[label]),
+                                       y_ranges, 'overview_granularity')]
+
+    def load(new):
+        """Show the dataset `new` (same structure) at the current granularity."""
+        nonlocal data
+        data = new
+        columns = data.table_data(granularities[controls[0].value] if controls else 'df_year')
+        fit_y(y_ranges, columns)
+        if detail is not None:
+            detail.set_data(columns)
+        else:
+            source_counts_class_pyear.data = columns
+
+    if swaps is not None:
+        swaps.append(load)
+
+    title_I_1 = Div(text="""<b>I.1. Overview of inventive activity</b>""", height=textbox_height)
+    title_I_2 = Div(text="""<b>I.2. Independent variables / Mediator</b>""", height=textbox_height)
+    title_I_3 = Div(text="""<b>I.3. Outcome variables: the value of invention</b>""", height=textbox_height)
+
+    notes_I_1 = Div(text="""There is a steady increase in the number of patents, inventors and assignees over time.
+                          The number of inventors per assignee also grows, as well as the number of patents filed by each assignee and by each inventor.""",width=200, height=300)
+    notes_I_2 = Div(text="""Fok drops slightly over time, especially after 1993.
+                          Inventions in the second half of the sampled period seem to originate in less field-original knowledge.
+                          <br>
+                          Novelty drops sensibly over time, from 0.923 in 1986 to 0.52 in 2000 (a 44% decline).""",width=200, height=200)
+    notes_I_3 = Div(text="""The distribution of invention value over time is not homogeneous. The most valuable inventions were created around
+                        the middle of the sample period (ca. 1992-1998), with highest average value and breakthrough rates, but
+                          the lowest probability of failure.
+                          <br>
+                          These figures suggest that the risk profile of inventions decreased between 1986 and ca. 1995.""",width=200, height=200)
+
+    return Panel(child = column(*controls,
+                                title_I_1, row(fig_1_a, notes_I_1),
+                                title_I_2, row(gridplot([plots[:2]]),notes_I_2),
+                                title_I_3, row(gridplot([plots[2:]]), notes_I_3)),
+                 title = tab_titles[0])
+
+### Tab II: overview by NBER tech categories
+
+def tab_nbercat(server=True, data=None, swaps=None):
+    data = data or precompute.load()
+    dataset = data.dataset
+    nbercats = data.nbercats()
+    labels = [dataset.categories.get(nbercat, str(nbercat)) for nbercat in nbercats]
+
+    # fig_3_a - fig_3_c,
+    var = list(dataset.counts)
+    varnames = [registry.label(dataset, v) for v in var]
+    plot_size = [(round(1000/len(var)) + (237 if i == len(var) - 1 else 0),400) for i in range(len(var))]
+    color = colors(len(nbercats))
+    plots = []
+    # one wide source (pyear plus every {var}_nbercat_{cat} column) for every figure of the tab
+    columns = data.table_data('df_year_nbercat_wide')
+    source_nbercat = ColumnDataSource(data=columns)
+    # renderers and whiskers of each category, for the category filter
+    renderers_nbercat = {nbercat: [] for nbercat in nbercats}
+    for i in range(len(var)):
+        plots.append(figure(title=varnames[i],
+                            x_axis_label='Year',
+                            plot_width=plot_size[i][0],
+                            plot_height=plot_size[i][1]))
+
+        for j,nbercat in enumerate(nbercats):
+            l = plots[i].line(x='pyear', y='{}_nbercat_{}'.format(var[i],nbercat),
+                              source=source_nbercat, color=color[j],legend_label=labels[j], line_width=1.5)
+            c = plots[i].circle(x='pyear', y='{}_nbercat_{}'.format(var[i],nbercat),
+                                source=source_nbercat,
+                                size=10, fill_color=color[j], line_color='white', alpha=.1,
+                                hover_alpha=.5)
+            renderers_nbercat[nbercat] += [l, c]
+            plots[i].add_tools(HoverTool(tooltips=[('Year','@pyear'),
+                                                   ('Count', '@{}_nbercat_{}'.format(var[i],nbercat))], mode='mouse'))
+        if i==len(var)-1:
+            plots[i].add_layout(plots[i].legend[0], 'right')
+        else:
+            plots[i].legend.visible=False
+    fig_3_a = plots[0]
+    for fig in plots[1:]:
+        fig.x_range = fig_3_a.x_range
+    count_plots = plots
+
+    # figs for fok and novelty, then the outcomes; the last of each row has the legend
+    var = list(dataset.metrics)
+    varnames = [registry.label(dataset, v) for v in var]
+    rows = [var[:2], var[2:]]
+    plot_size = [(round(1000/len(r)) + (237 if i == len(r) - 1 else 0),400) for r in rows for i in range(len(r))]
+    last = [len(var[:2]) - 1, len(var) - 1]
+    plots = []
+    y_ranges = []
+    for i in range(len(var)):
+        plots.append(figure(title=varnames[i], x_axis_label='Year', plot_width=plot_size[i][0], plot_height=plot_size[i][1]))
+        low, hi = registry.bounds(dataset, var[i])
+        bounds = (['{}_nbercat_{}'.format(low, nbercat) for nbercat in nbercats],
+                  ['{}_nbercat_{}'.format(hi, nbercat) for nbercat in nbercats])
+        plots[i].y_range=Range1d(*y_bounds(columns, *bounds))
+        y_ranges.append((plots[i].y_range,) + bounds)
+
+        for j,nbercat in enumerate(nbercats):
+            l = plots[i].line(x='pyear', y='{}_nbercat_{}'.format(var[i],nbercat),
+                              source=source_nbercat,
+                              line_width=1.5, line_color=color[j],
+                              legend_label=labels[j], name='y{}'.format(j))
+            w = Whisker(source=source_nbercat,
+                        base="pyear",
+                        upper='{}_nbercat_{}'.format(hi,nbercat), lower='{}_nbercat_{}'.format(low,nbercat),
+                        level="overlay", line_color=color[j])
+            w.upper_head.line_color = color[j]
+            w.lower_head.line_color = color[j]
+            plots[i].add_layout(w)
+            renderers_nbercat[nbercat] += [l, w]
+            plots[i].add_tools(HoverTool(tooltips=[('Year','@pyear'),
+                                                   ('Avg', '@{}_nbercat_{}'.format(var[i],nbercat))], mode='mouse'))
+        if i in last:
+            plots[i].add_layout(plots[i].legend[0], 'right')
+        else:
+            plots[i].legend.visible=False
+    for fig in plots:
+        fig.x_range = fig_3_a.x_range
+
+    # Filters: categories toggle the visibility of their renderers and the year window moves the
+    # shared x range, so an interaction only patches a few properties, never the source data
+    # (except, at monthly or weekly granularity, for the level of detail of the new window).
+    filters = []
+    if server:
+        detail = None
+        granularity = None
+        granularities = data.available_granularities()
+        if len(granularities) > 1:
+            detail = lod.LevelOfDetail(source_nbercat, fig_3_a.x_range, name='nbercat_lod')
+            detail.attach(*count_plots, *plots)
+            granularity = granularity_select(detail, list(granularities),
+                                             lambda label: data.table_data('{}_nbercat_wide'.format(granularities[label])),
+                                             y_ranges, 'nbercat_granularity')
+            filters.append(granularity)
+        pyears = source_nbercat.data['pyear']
+        category_filter = CheckboxGroup(labels=labels,
+                                        active=list(range(len(nbercats))), inline=True, name='category_filter')
+        year_filter = RangeSlider(title='Years', start=int(pyears.min()), end=int(pyears.max()),
+                                  value=(int(pyears.min()), int(pyears.max())), step=1, width=400, name='year_filter')
+
+        def on_categories(attr, old, new):
+            with instrument.interaction(category_filter, 'nbercat_categories'):
+                for j, nbercat in enumerate(nbercats):
+                    for r in renderers_nbercat[nbercat]:
+                        r.visible = j in new
+
+        def on_years(attr, old, new):
+            with instrument.interaction(year_filter, 'nbercat_years'):
+                fig_3_a.x_range.start, fig_3_a.x_range.end = new[0] - .5, new[1] + .5
+                if detail is not None:
+                    detail.show(new[0] - .5, new[1] + .5)
+
+        def load(new):
+            """Show the dataset `new` (same structure) at the current granularity, over all its years."""
+            nonlocal data
+            data = new
+            columns = data.table_data('{}_nbercat_wide'.format(granularities[granularity.value] if granularity else 'df_year'))
+            fit_y(y_ranges, columns)
+            pyears = data.table_data('df_year_nbercat_wide')['pyear']
+            years = int(pyears.min()), int(pyears.max())
+            if tuple(year_filter.value) != years:
+                fig_3_a.x_range.start, fig_3_a.x_range.end = years[0] - .5, years[1] + .5
+            year_filter.update(start=years[0], end=years[1], value=years)
+            if detail is not None:
+                detail.set_data(columns)
+            else:
+                source_nbercat.data = columns
+
+        category_filter.on_change('active', on_categories)
+        year_filter.on_change('value_throttled', on_years)
+        filters = [row(category_filter, year_filter, *filters)]
+        if swaps is not None:
+            swaps.append(load)
+
+    title_II_1 = Div(text="""<b>II.1. Overview of inventive activity</b>""", height=textbox_height)
+    title_II_2 = Div(text="""<b>II.2. Independent variables / Mediator</b>""", height=textbox_height)
+    title_II_3 = Div(text="""<b>II.3. Outcome variables: the value of invention</b>""", height=textbox_height)
+
+    notes_II_1 = Div(text="""The growth of patents, inventors and assignees shows strong differences across technology sectors.
+                     <br>
+                     The largest growth is in 'Computer & Communications'; the smallest, in 'Mechanical'.""",width=180, height=300)
+    notes_II_2 = Div(text="""Fok is remarkably stable over time, but there are differences in levels across tech sectors.
+                     <br>
+                     Inventors in 'Drugs & Medical' have the least field-original knowledge (!) (i.e., the most field-specific knowledge, and
+                     less likely to cross-breed across sectors), and their knowledge tends to get even more field-specific over time.
+                     <br>
+                     'Chemical' has the smallest decrease in novelty over time; 'Drugs & Medical' the largest.
+                     <br><br>
+                     'Computer & Comm.' is the sector with largest growth in the period, but is also the least novel one.""",width=180, height=300)
+    notes_II_3 = Div(text="""Changes in value over time are more evident in 'average value' (as measured by forward cites) than in the binary breakthrough/fail dummies.""",width=180, height=300)
+
+    return Panel(child = column(*filters,
+                                title_II_1, row(gridplot([count_plots]), notes_II_1),
+                                title_II_2, row(gridplot([plots[:2]]), notes_II_2),
+                                title_II_3, row(gridplot([plots[2:]]), notes_II_3)),
+                 title = tab_titles[1])
+
+### Tab III: fok and novelty
+
+def tab_fok_novelty(server=True, data=None, swaps=None):
+    data = data or precompute.load()
+    dataset = data.dataset
+    palette = colors(len(dataset.counts) + len(dataset.metrics))
+    # fok x novelty aggregates at every available resolution (see precompute.Data.pyramid)
+    levels = data.pyramid()
+    q = 20
+    level = levels[q]
+
+    # Figure 2_a: Fok y novelty
+    source_df_20_fok_nov = ColumnDataSource(data=dict(level['fok_nov']))
+
+    color = palette[0]
+
+    fig_2_a = figure(x_axis_label=quantiles(q, 'field-original knowledge'),
+                     y_axis_label='New combinations (log)',
+                     plot_width=1000, plot_height=300)
+    fig_2_a.line(x='fok_q',y='log_novelty',
+                 source=source_df_20_fok_nov, color=color)
+    plot = fig_2_a.circle(x='fok_q', y='log_novelty',
+                          source = source_df_20_fok_nov, size=5,
+                          fill_color=color, line_color='white', alpha=.1,
+                          hover_fill_color = color, hover_alpha=.5, hover_line_color='white')
+    w = Whisker(source=source_df_20_fok_nov,
+                base="fok_q", upper="upper", lower="lower", level="overlay", line_color=color)
+    w.upper_head.line_color = color
+    w.lower_head.line_color = color
+    fig_2_a.add_layout(w)
+    fig_2_a.add_tools(HoverTool(renderers=[plot], tooltips=[('Fok quantile','@fok_q'),('Avg.','@log_novelty')], mode='vline'))
+
+    # Figure 2_b - : scatter plot de bt
+    TOOLS = "hover,save,pan,box_zoom,reset,wheel_zoom"
+    var = list(dataset.heatmap_metrics)
+    varnames = [registry.label(dataset, v) for v in var]
+    mappers = []
+    for i in var:
+        mappers.append(LinearColorMapper(palette=Viridis256, low=np.nanmin(level['grid'][i]), high=np.nanmax(level['grid'][i])))
+
+    source_df_20 = ColumnDataSource(data=dict(level['grid']), name='source_df_20')
+    # grids finer than image_threshold bins are drawn as one image per heatmap instead of q*q rects
+    source_images = ColumnDataSource(data={v: [] for v in var})
+    scatters = []
+    rects = []
+    images = []
+    plot_size = round(1000/3)
+    for i in range(len(var)):
+        scatters.append(figure(title='{}'.format(varnames[i]),x_axis_label = quantiles(q, 'fok'),
+                              plot_width=plot_size, plot_height=plot_size,tools=TOOLS, toolbar_location='below',
+                              x_range=Range1d(-.5, q - .5), y_range=Range1d(-.5, q - .5),
+                              tooltips=[('fok:', '@fok_q'),('novelty:', '@novelty_q'), ('Avg. {}'.format(varnames[i]), '@{}'.format(var[i]))]))
+        scatters[i].grid.grid_line_color = None
+        scatters[i].axis.axis_line_color = None
+        scatters[i].axis.major_tick_line_color = None
+        scatters[i].axis.major_label_text_font_size = "7px"
+        scatters[i].axis.major_label_standoff = 0
+        scatters[i].xaxis.major_label_orientation = math.pi / 3
+
+        rects.append(scatters[i].rect(x="fok_q", y="novelty_q",
+                                      width=1, height=1,
+                                      source=source_df_20,
+                                      fill_color={'field': var[i], 'transform': mappers[i]},line_color=None,
+                                      selection_line_color='white', selection_line_width=2, nonselection_fill_alpha=.7))
+        # the figure's hover only reads the columns of the rects; images have their own
+        scatters[i].select_one(HoverTool).renderers = [rects[i]]
+        if server and max(levels) > image_threshold:
+            images.append(scatters[i].image(image=var[i], x=-.5, y=-.5, dw=q, dh=q,
+                                            source=source_images, color_mapper=mappers[i], visible=False))
+            scatters[i].add_tools(HoverTool(renderers=[images[-1]],
+                                            tooltips=[('fok:', '$x{0}'),('novelty:', '$y{0}'), ('Avg. {}'.format(varnames[i]), '@image')]))
+        color_bar = ColorBar(color_mapper=mappers[i],
+                             major_label_text_font_size="7px",ticker=BasicTicker(desired_num_ticks=len(Viridis256)),
+                             #formatter=PrintfTickFormatter(format="%d%%"),
+                             label_standoff=6, border_line_color=None)
+        scatters[i].add_layout(color_bar, 'right')
+        if i==0:
+            scatters[i].yaxis.axis_label = quantiles(q, 'novelty')
+    fig_2_b = scatters[0]
+
+    for fig in scatters[1:]:
+        fig.x_range = fig_2_b.x_range
+        fig.y_range = fig_2_b.y_range
+
+    # Drill-down: clicking a heatmap cell shows the distribution of the three metrics in it.
+    # The histograms come from the per-cell index in precompute.py (a single array lookup),
+    # and a click only patches their counts, never the grid. The index is at 20 bins only.
+    hists = data.hist_index() if server else None
+    drilldown = []
+    selected_cell = None
+    if hists is not None:
+        sources_hist = []
+        hist_figs = []
+        for i in range(len(var)):
+            left, right, counts = hists[var[i]]
+            sources_hist.append(ColumnDataSource(data={'left': left, 'right': right, 'count': np.zeros(len(left))}))
+            hist_figs.append(figure(title=varnames[i], plot_width=plot_size, plot_height=200,
+                                    tools='', toolbar_location=None))
+            hist_figs[i].quad(left='left', right='right', bottom=0, top='count',
+                              source=sources_hist[i], fill_color=palette[i], line_color='white')
+        drill_hint = """Click a cell of the heatmaps to see the distribution of the value measures within it."""
+        drill_info = Div(text=drill_hint, width=180, height=200)
+
+        def on_select(attr, old, new):
+            nonlocal selected_cell
+            if not new or q != 20:
+                return
+            with instrument.interaction(source_df_20, 'heatmap_drilldown'):
+                cells = source_df_20.data
+                cell = int(cells['fok_q'][new[0]]), int(cells['novelty_q'][new[0]])
+                if cell == selected_cell:
+                    return
+                selected_cell = cell
+                for i in range(len(var)):
+                    counts = hists[var[i]][2][cell]
+                    sources_hist[i].patch({'count': [(slice(len(counts)), counts.tolist())]})
+                drill_info.text = """<b>fok quantile {}, novelty quantile {}</b><br>{:,.0f} observations""".format(
+                    cell[0], cell[1], hists[var[0]][2][cell].sum())
+
+        source_df_20.selected.on_change('indices', on_select)
+        for fig in scatters:
+            fig.add_tools(TapTool())
+        title_III_3 = Div(text="""<b>III.3. Distribution within a cell</b>""", height=textbox_height)
+        drilldown = [title_III_3, row(*hist_figs, drill_info)]
+
+    def show(k):
+        """Point the sources, ranges and color mappers at the pyramid level of `k` bins."""
+        nonlocal q, selected_cell
+        q = k
+        level = levels[q]
+        use_image = q > image_threshold and bool(images)
+        selected_cell = None
+        source_df_20.selected.indices = []
+        source_df_20_fok_nov.data = dict(level['fok_nov'])
+        source_df_20.data = {c: [] for c in level['grid']} if use_image else dict(level['grid'])
+        source_images.data = {v: [level['images'][v]] if use_image else [] for v in var}
+        for r in (fig_2_b.x_range, fig_2_b.y_range):
+            r.start, r.end = -.5, q - .5
+        for i in range(len(var)):
+            rects[i].visible = not use_image
+            mappers[i].low, mappers[i].high = np.nanmin(level['grid'][var[i]]), np.nanmax(level['grid'][var[i]])
+        for image in images:
+            image.visible = use_image
+            image.glyph.dw = image.glyph.dh = q
+        for model in drilldown:
+            model.visible = q == 20
+        fig_2_a.xaxis.axis_label = quantiles(q, 'field-original knowledge')
+        for fig in scatters:
+            fig.xaxis.axis_label = quantiles(q, 'fok')
+        fig_2_b.yaxis.axis_label = quantiles(q, 'novelty')
+
+    # Resolution: switching swaps the sources to another level of the pyramid
+    controls = []
+    if server and len(levels) > 1:
+        resolution_select = Select(title='Quantile bins', value=str(q), options=[str(k) for k in sorted(levels)],
+                                   width=120, name='resolution_select')
+
+        def on_resolution(attr, old, new):
+            with instrument.interaction(resolution_select, 'heatmap_resolution'):
+                show(int(new))
+
+        resolution_select.on_change('value', on_resolution)
+        controls = [resolution_select]
+
+    def load(new):
+        """Show the dataset `new` (same structure) at the current resolution."""
+        nonlocal levels, hists
+        levels = new.pyramid()
+        if hists is not None:
+            hists = new.hist_index()
+            for i in range(len(var)):
+                left, right, counts = hists[var[i]]
+                sources_hist[i].data = {'left': left, 'right': right, 'count': np.zeros(len(left))}
+            drill_info.text = drill_hint
+        show(q)
+
+    if swaps is not None:
+        swaps.append(load)
+
+    title_III_1 = Div(text="""<b>III.1. The relationship between field-original knowledge and recombinant novelty</b>""", height=textbox_height)
+    title_III_2 = Div(text="""<b>III.2. Fok, novelty and invention value</b>""", height=textbox_height)
+
+    notes_III_1 = Div(text="""The figure plots the average number of new combinations of patents at different quintiles of field-original knowledge.
+                      Inventors with more field-original knowledge create inventions that are more novel on average (i.e., with more new combinations of technological components).""",width=180, height=300)
+    notes_III_2 = Div(text="""The heatmaps plot the value measures against quintiles of novelty and field-original knowledge:
+                      <br>
+                      1) Greater novelty is associated with more citations on average, at all levels of fok.
+                      <br>
+                      2) Breakthroughs originate disproportionately in inventors with high fok producing with the largest degree of novelty.
+                      <br>
+                      3) Greater fok is also tied with larger chance of failure (particularly when producing inventions with a low degree of novelty).""",width=180, height=300)
+
+    return Panel(child = column(*controls,
+                                title_III_1, row(fig_2_a, notes_III_1),
+                                title_III_2, row(gridplot([scatters]), notes_III_2),
+                                *drilldown),
+                 title = tab_titles[2])
+
+# Tab 4: Data sources and main variables
+
+def tab_data(server=True, data=None, swaps=None):
+    variables_head = Div(text="""<b>Main variables</b>""", height=textbox_height)
+    variables_body = Div(text="""<p> <b>Field-original knowledge:</b> weighted average distance between each of the three-digit technology classes in an inventor's prior patents and each of the
+three-digit technology classes in the focal patent, weighted by the number of prior patents the inventor filed in the class. Here, 'distance' comes from
+a Markov matrix wherein the transition probabilities p_tij represent the probability that a patent-filing inventor in year t with experience in class
+i files a patent in class j <br>
+<b>New combinations (log):</b> number of subclass combination pairs that never occurred in patents before <br>
+<b>Breakthrough:</b> equals one if the invention is among the top 1% most-cited relative to patents applied in the same year and technology class, and zero otherwise <br>
+<b>Failure:</b> equals 1 if the invention is among the 25% least-cited patents relative to patents applied in the same year and technology classes <br>
+<b>Forward citations 10y (log):</b> Number of citations received by the focal patent within 10 years of its application <br> </p>
+""", width=800, height=500)
+
+    data_head = Div(text="""<b>Data sources</b>""", height=textbox_height)
+    data_body = Div(text="""<p> The raw data comes from all U.S. utility patents with first priority dates between 1976 and 2000. Patent data was sourced from Patstat 2018-April and
+USPTO Bulk downloads (v2015). Disambiguated inventor names used to build the patent careers of inventors come from Li et al. (2014) and Balsmeier et al. (2015).
+For methodological reasons, explained in the paper, observations are limited to patents filed by inventors residing in the US who work at a firm, and who filed at least two patents with
+the same firm. Additionally, only inventors whose first patent was filed after 1976 are included.<br>
+The final dataset includes 677,049 observations, 379,127 patents with priority application year between 1986 and 2000, filed by 104,483 inventors working for 9,945 assignee firms. </p>
+""", width=800, height=500)
+
+    return Panel(child = column(data_head, data_body, variables_head, variables_body),
+                 title = tab_titles[3])
+
+# Tab 5: Abstract
+
+def tab_abstract(server=True, data=None, swaps=None):
+    abstract_head = Div(text="""<b>Abstract</b>""", height=textbox_height)
+    abstract_body = Div(text="""<p>Do inventors with uncommon knowledge produce more creative inventions? The answer is `yes', with reserves.
+Using data on the careers of 100,000 inventors over 15 years of corporate U.S. patents and an inventor-firm fixed effects panel, I document that
+inventors with field-original knowledge---i.e., uncommon among others who work in the same field---produce inventions which are on average more
+ novel and more likely to be exceptionally valuable, but more likely to be failures as well. Additionally, estimates from structural equation
+ models illustrate that novelty is at the same time an outcome of the search process and a contributor to the creation of economic breakthroughs.
+  Caution is due because the rate of failure increases as well, suggesting uncertainty, rather than recombinant fertility or displaced expertise,
+  is the driving mechanism. </p>""", width=800, height=300)
+
+    return Panel(child = column(abstract_head, abstract_body),
+                 title = tab_titles[4])
+
+tab_builders = [tab_overview, tab_nbercat, tab_fok_novelty, tab_data, tab_abstract]
+
+def build_tab(i, server=True, data=None, swaps=None):
+    """Tab `i` showing `data` (default: the default dataset). Its builder appends to the
+    list `swaps` the callbacks that load another dataset of the same structure into it."""
+    with instrument.section(tab_builders[i].__name__):
+        return tab_builders[i](server, data, swaps)
+
+# headings, titles and notes
+
+def heading():
+    return Div(text="""<p style="font-size:20px"><b>Enchanted Wanderer or Stone Guest? On field-original knowledge and the creativity of invention</b></p><br>
+              By Manuel Gigena <br>
+              This interactive dashboard is an on-line companion to my <a href="https://sites.google.com/view/mgigena/research">working paper</a> with the
+              same name, and is meant to facilitate exploration of its unique dataset.<br><br>""", height=textbox_height)
+
+def dataset_select(tabs, state, swaps, build):
+    """Select of the dataset shown by the session.
+
+    `state['data']` is the Data of the current dataset and `swaps` maps each built tab to its
+    swap callbacks. A dataset of the same structure is loaded into the existing models;
+    otherwise the built tabs get new children from `build(i)`.
+    """
+    options = [(name, dataset.title) for name, dataset in registry.datasets.items()]
+    select = Select(title='Dataset', value=state['data'].dataset.name, options=options, width=300, name='dataset_select')
+
+    def on_dataset(attr, old, new):
+        with instrument.interaction(select, 'dataset_swap'):
+            data = precompute.load(new)
+            in_place = data.structure() == state['data'].structure()
+            state['data'] = data
+            for i in list(swaps):
+                if in_place:
+                    for load in swaps[i]:
+                        load(data)
+                else:
+                    tabs.tabs[i].child = build(i).child
+
+    select.on_change('value', on_dataset)
+    return select
+
+def lazy_tabs(build=build_tab):
+    """Tabs where only Tab I is built up front, by `build(i)`.
+
+    The other tabs start as a placeholder and are built the first time they are
+    activated; their models then stay in the session's document, so switching back to
+    them is free.
+    """
+    panels = [build(0)]
+    for tab_title in tab_titles[1:]:
+        panels.append(Panel(child=Div(text='Loading...'), title=tab_title))
+    tabs = Tabs(tabs=panels)
+    built = {0}
+
+    def on_active(attr, old, new):
+        if new not in built:
+            built.add(new)
+            tabs.tabs[new].child = build(new).child
+    tabs.on_change('active', on_active)
+    return tabs
+
+def layout(lazy=True, server=True, dataset=None):
+    """The whole dashboard: heading plus the five tabs (built on demand if `lazy`), showing
+    the registered `dataset` (default: registry.default).
+
+    `server=False` leaves out the widgets that need python callbacks, for the static export.
+    """
+    with instrument.section('layout'):
+        state = {'data': precompute.load(dataset)}
+        # built tab -> its swap callbacks
+        swaps = {}
+
+        def build(i):
+            swaps[i] = []
+            return build_tab(i, server, state['data'], swaps[i])
+
+        tabs = lazy_tabs(build) if lazy else Tabs(tabs=[build(i) for i in range(len(tab_builders))])
+        top = heading()
+        if server and len(registry.datasets) > 1:
+            top = row(top, dataset_select(tabs, state, swaps, build))
+        return column(top, tabs)
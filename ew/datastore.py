@@ -0,0 +1,151 @@
+# -*- coding: utf-8 -*-
+"""
+Columnar binary cache for the tables in csv/.
+
+Each csv/<name>.csv is converted once into cache/<name>/, one .npy file per column plus
+a manifest.json with the sha256 of the source csv, the column order and the dtypes.
+Sessions load the tables by memory-mapping the .npy files read-only, so concurrent
+sessions (and server processes) share the same pages instead of each parsing its own
+copy of the csv. A table is rebuilt whenever the checksum of its csv changes.
+Every function takes the `csv` and `cache` folders of a dataset (see registry.py),
+csv/ and cache/ by default.
+
+Usage:
+    python datastore.py                   # (re)build the cache of the default dataset
+    python datastore.py --check           # report which tables are stale
+    python datastore.py --dataset <name>  # the same for another dataset of registry.py
+
+"""
+
+# imports
+import argparse
+import hashlib
+import json
+import os
+import shutil
+import numpy as np
+import pandas as pd
+
+
+###########################################
+## Locations
+here = os.path.dirname(os.path.abspath(__file__))
+csv_dir = os.path.join(here, 'csv')
+cache_dir = os.environ.get('EW_CACHE_DIR', os.path.join(here, 'cache'))
+tables = ['df_year', 'df_20', 'df_20_fok_nov', 'df_year_nbercat']
+# written by aggregate.py from the observation panel; features that need them are
+# disabled when they are missing
+optional_tables = ['df_20_hist_log_cit_10', 'df_20_hist_bt', 'df_20_hist_fail', 'df_grid_100',
+                   'df_month', 'df_month_nbercat', 'df_week', 'df_week_nbercat']
+
+###########################################
+## Build
+
+def checksum(path):
+    h = hashlib.sha256()
+    with open(path, 'rb') as f:
+        for chunk in iter(lambda: f.read(1 << 20), b''):
+            h.update(chunk)
+    return h.hexdigest()
+
+def read_manifest(name, cache=None):
+    try:
+        with open(os.path.join(cache or cache_dir, name, 'manifest.json')) as f:
+            return json.load(f)
+    except (OSError, ValueError):
+        return None
+
+def is_fresh(name, csv=None, cache=None):
+    manifest = read_manifest(name, cache)
+    return manifest is not None and manifest['sha256'] == checksum(os.path.join(csv or csv_dir, '{}.csv'.format(name)))
+
+def build_table(name, csv=None, cache=None):
+    """Convert csv/<name>.csv into cache/<name>/ and return its manifest.
+
+    The columns are written to a temporary directory that then replaces the old one, so
+    that readers never see a half-written table. Sessions that still map the old files
+    keep their (unlinked) pages until they release them.
+    """
+    cache = cache or cache_dir
+    path = os.path.join(csv or csv_dir, '{}.csv'.format(name))
+    sha = checksum(path)
+    df = pd.read_csv(path)
+    tmp = os.path.join(cache, '.{}.{}'.format(name, os.getpid()))
+    shutil.rmtree(tmp, ignore_errors=True)
+    os.makedirs(tmp)
+    dtypes = {}
+    for i, col in enumerate(df.columns):
+        values = df[col].to_numpy()
+        if values.dtype == object:
+            values = values.astype(str)
+        np.save(os.path.join(tmp, '{}.npy'.format(i)), np.ascontiguousarray(values))
+        dtypes[col] = values.dtype.str
+    manifest = {'sha256': sha, 'columns': list(df.columns), 'dtypes': dtypes, 'rows': len(df)}
+    with open(os.path.join(tmp, 'manifest.json'), 'w') as f:
+        json.dump(manifest, f, indent=1)
+
+    final = os.path.join(cache, name)
+    old = '{}.old.{}'.format(tmp, os.getpid())
+    try:
+        if os.path.exists(final):
+            os.rename(final, old)
+        os.rename(tmp, final)
+    except OSError:
+        # another process published the same table first
+        shutil.rmtree(tmp, ignore_errors=True)
+    shutil.rmtree(old, ignore_errors=True)
+    return manifest
+
+def available(names, csv=None):
+    return [name for name in names if os.path.exists(os.path.join(csv or csv_dir, '{}.csv'.format(name)))]
+
+def csv_names(csv=None):
+    return sorted(f[:-4] for f in os.listdir(csv or csv_dir) if f.endswith('.csv'))
+
+def build(names=None, force=False, csv=None, cache=None):
+    """Build the cache for `names` (default: every csv in csv/); return the rebuilt names."""
+    if names is None:
+        names = csv_names(csv)
+    rebuilt = []
+    for name in names:
+        if force or not is_fresh(name, csv, cache):
+            build_table(name, csv, cache)
+            rebuilt.append(name)
+    return rebuilt
+
+###########################################
+## Load
+
+def load_table(name, check=True, csv=None, cache=None):
+    """DataFrame backed by read-only memory maps of cache/<name>/ (rebuilt if stale)."""
+    manifest = read_manifest(name, cache)
+    if manifest is None or (check and not is_fresh(name, csv, cache)):
+        manifest = build_table(name, csv, cache)
+    folder = os.path.join(cache or cache_dir, name)
+    columns = {col: np.load(os.path.join(folder, '{}.npy'.format(i)), mmap_mode='r')
+               for i, col in enumerate(manifest['columns'])}
+    # copy=False keeps one block per column, i.e. no consolidation copy of the maps
+    return pd.DataFrame(columns, columns=manifest['columns'], copy=False)
+
+def load_tables(names=tables, check=True, csv=None, cache=None):
+    """The dashboard tables, as the script used to get them from pd.read_csv."""
+    return {name: load_table(name, check, csv, cache) for name in names}
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Build the columnar cache of the csv tables.')
+    parser.add_argument('names', nargs='*', help='tables to build (default: all)')
+    parser.add_argument('--force', action='store_true', help='rebuild even if the checksums match')
+    parser.add_argument('--check', action='store_true', help='only report stale tables')
+    parser.add_argument('--dataset', help='dataset of registry.py (default: the default dataset)')
+    args = parser.parse_args()
+    names = args.names or None
+    import registry
+    dataset = registry.get(args.dataset)
+    csv, cache = dataset.csv_dir, dataset.cache_dir
+    if args.check:
+        for name in names or csv_names(csv):
+            print('{:<20}{}'.format(name, 'fresh' if is_fresh(name, csv, cache) else 'stale'))
+    else:
+        for name in build(names, force=args.force, csv=csv, cache=cache):
+            print('built {}'.format(name))
@@ -0,0 +1,144 @@
+# -*- coding: utf-8 -*-
+"""
+Sticky front of several bokeh serve workers (see serve.py).
+
+A bokeh session lives in the process that created it: the page request (or autoload.js)
+creates the session and renders its document, and the websocket the page then opens
+attaches to it. Workers sharing one listening socket receive the two requests
+independently, and a websocket reaching another worker makes that worker build the
+document a second time. The front routes both requests by session id instead:
+    - a request for the application page gets its session id from the front, which
+      passes it to the worker in the Bokeh-Session-Id header (unless it already names
+      its session, by id or by token)
+    - a websocket carries the session id in its token (the second subprotocol the
+      browser sends), which the front decodes
+and a session id always maps to the same worker (`worker_for`). Any other request
+(static files) goes to the workers in turn. The workers check the websocket origin
+themselves, so the front forwards the Host and Origin headers untouched. The front
+relays up to `clients_per_worker` requests per worker at once; more wait in its queue.
+
+"""
+
+# imports
+import itertools
+import logging
+import zlib
+import tornado.httpclient
+import tornado.httputil
+import tornado.web
+import tornado.websocket
+from bokeh.util.token import generate_session_id, get_session_id
+
+log = logging.getLogger(__name__)
+
+# the largest websocket message relayed, as bokeh serve's default
+max_message_size = 20 * 1024 * 1024
+# requests relayed at once, per worker (tornado's default is 10 in all)
+clients_per_worker = 64
+# request and response headers that only concern one hop
+hop_headers = {'Connection', 'Keep-Alive', 'Proxy-Connection', 'Transfer-Encoding', 'Upgrade', 'Content-Length'}
+
+def worker_for(session_id, n):
+    return zlib.crc32(session_id.encode('utf-8')) % n
+
+def token_session_id(token):
+    """Session id of a bokeh token, or None if it is not one (the worker rejects it)."""
+    try:
+        return get_session_id(token)
+    except (ValueError, KeyError):
+        return None
+
+
+class ProxyHandler(tornado.web.RequestHandler):
+    SUPPORTED_METHODS = ('GET', 'HEAD', 'POST')
+
+    def initialize(self, workers, app_path, turns):
+        self.workers = workers
+        self.app_path = app_path
+        self.turns = turns
+
+    def session_id(self, headers):
+        """Session id named by the request (by id or token); a new one, passed on in
+        `headers`, for an application request that does not name any."""
+        token = self.get_argument('bokeh-token', None)
+        if token is not None:
+            return token_session_id(token)
+        session_id = self.get_argument('bokeh-session-id', None) or headers.get('Bokeh-Session-Id')
+        if session_id is None and self.request.path.rstrip('/') in (self.app_path, self.app_path + '/autoload.js'):
+            session_id = headers['Bokeh-Session-Id'] = generate_session_id()
+        return session_id
+
+    async def forward(self):
+        headers = tornado.httputil.HTTPHeaders({k: v for k, v in self.request.headers.get_all()
+                                                if k not in hop_headers})
+        session_id = self.session_id(headers)
+        worker = self.workers[worker_for(session_id, len(self.workers)) if session_id else next(self.turns)]
+        response = await tornado.httpclient.AsyncHTTPClient().fetch(
+            'http://{}{}'.format(worker, self.request.uri), method=self.request.method, headers=headers,
+            body=self.request.body if self.request.method == 'POST' else None,
+            follow_redirects=False, decompress_response=False, raise_error=False)
+        if response.code == 599:
+            log.warning('worker %s unreachable: %s', worker, response.error)
+            raise tornado.web.HTTPError(502)
+        self.set_status(response.code, response.reason)
+        for name in ('Content-Type', 'Server', 'Date'):
+            self.clear_header(name)
+        for k, v in response.headers.get_all():
+            if k not in hop_headers:
+                self.add_header(k, v)
+        if response.body:
+            self.write(response.body)
+
+    get = head = post = forward
+
+
+class WebSocketProxy(tornado.websocket.WebSocketHandler):
+    def initialize(self, workers):
+        self.workers = workers
+        self.subprotocols = []
+        self.upstream = None
+
+    def check_origin(self, origin):
+        return True  # checked by the worker
+
+    def select_subprotocol(self, subprotocols):
+        self.subprotocols = subprotocols
+        return subprotocols[0] if subprotocols else None
+
+    async def open(self):
+        # bokeh sends ['bokeh', token]
+        session_id = token_session_id(self.subprotocols[1]) if len(self.subprotocols) == 2 else None
+        worker = self.workers[worker_for(session_id or '', len(self.workers))]
+        headers = {k: v for k, v in self.request.headers.get_all()
+                   if k in ('Host', 'Origin', 'Cookie', 'User-Agent')}
+        request = tornado.httpclient.HTTPRequest('ws://{}{}'.format(worker, self.request.uri), headers=headers)
+        try:
+            self.upstream = await tornado.websocket.websocket_connect(
+                request, subprotocols=self.subprotocols, max_message_size=max_message_size,
+                on_message_callback=self.on_upstream_message)
+        except (OSError, tornado.httpclient.HTTPClientError) as e:
+            log.warning('websocket to worker %s failed: %s', worker, e)
+            self.close(1011)
+
+    def on_upstream_message(self, message):
+        if message is None:
+            self.close()
+        elif self.ws_connection is not None:
+            self.write_message(message, binary=isinstance(message, bytes))
+
+    def on_message(self, message):
+        if self.upstream is not None:
+            self.upstream.write_message(message, binary=isinstance(message, bytes))
+
+    def on_close(self):
+        if self.upstream is not None:
+            self.upstream.close()
+
+
+def application(workers, app_path):
+    """Tornado application routing `app_path` (e.g. '/ew') to the `workers` (host:port)."""
+    tornado.httpclient.AsyncHTTPClient.configure(None, max_clients=clients_per_worker * len(workers))
+    return tornado.web.Application([
+        (app_path + r'/ws', WebSocketProxy, {'workers': workers}),
+        (r'.*', ProxyHandler, {'workers': workers, 'app_path': app_path, 'turns': itertools.cycle(range(len(workers)))}),
+    ], websocket_max_message_size=max_message_size)
@@ -0,0 +1,187 @@
+# -*- coding: utf-8 -*-
+"""
+Instrumentation of the server: sections, session documents and interactive callbacks.
+
+`interaction(model, name)` wraps the body of a python callback: it times it and records
+every document change the callback makes, i.e. what the server sends to the browser as a
+PATCH-DOC message, and logs the patch size. Callbacks slower than `latency_budget_ms`
+are logged as warnings. The last measurements per interaction are kept in `history`.
+
+With EW_METRICS=1 in the environment, the server also collects histograms of:
+    section_ms      `section(name)` blocks: data load (only in the process that reads the
+                    tables), each tab build, layout, extra_serialization
+    callback_ms     `interaction` blocks, and their patch_bytes
+    document_*      models and JSON bytes of each session's document at creation; measuring
+                    them serializes the document once more, on top of what bokeh sends
+                    (timed as extra_serialization), a cost every session pays with metrics on
+`start` (called from on_server_loaded) then logs a summary line every
+EW_METRICS_LOG_INTERVAL seconds (default 60, 0 to disable) and, if EW_METRICS_PORT is
+set, serves them at http://127.0.0.1:<port>/metrics in the Prometheus text format (worker
+i of a multi-process server at <port> + i, see `worker_port`).
+When EW_METRICS is unset, sections cost a generator and document sizes are not measured.
+
+"""
+
+# imports
+import bisect
+import collections
+import contextlib
+import logging
+import os
+import time
+import tornado.ioloop
+import tornado.web
+from bokeh.protocol import Protocol
+
+log = logging.getLogger(__name__)
+
+enabled = os.environ.get('EW_METRICS', '') not in ('', '0')
+latency_budget_ms = 50
+history = collections.defaultdict(lambda: collections.deque(maxlen=1000))
+
+Interaction = collections.namedtuple('Interaction', ['ms', 'events', 'bytes'])
+
+###########################################
+## Histograms
+
+buckets = {'ms': [1, 2, 5, 10, 20, 50, 100, 200, 500, 1000, 2000, 5000],
+           'bytes': [1e3, 1e4, 2e4, 5e4, 1e5, 2e5, 5e5, 1e6, 2e6, 5e6],
+           'models': [50, 100, 200, 500, 1000, 2000, 5000]}
+
+class Histogram:
+    """Counts of observations per bucket (upper bounds), plus their count, sum and max."""
+
+    def __init__(self, bounds):
+        self.bounds = bounds
+        self.counts = [0] * (len(bounds) + 1)
+        self.count = 0
+        self.sum = 0.
+        self.max = 0.
+
+    def observe(self, value):
+        self.counts[bisect.bisect_left(self.bounds, value)] += 1
+        self.count += 1
+        self.sum += value
+        self.max = max(self.max, value)
+
+# (metric, label) -> Histogram, e.g. ('section_ms', 'tab_nbercat')
+metrics = {}
+
+def observe(metric, label, value):
+    if (metric, label) not in metrics:
+        metrics[metric, label] = Histogram(buckets[metric.rsplit('_', 1)[1]])
+    metrics[metric, label].observe(value)
+
+###########################################
+## Measurements
+
+def patch_bytes(events):
+    """Size of the PATCH-DOC message carrying `events` (arrays inlined as base64)."""
+    if not events:
+        return 0
+    msg = Protocol().create('PATCH-DOC', events, use_buffers=False)
+    return sum(len(part.encode('utf-8')) for part in (msg.header_json, msg.metadata_json, msg.content_json))
+
+@contextlib.contextmanager
+def section(name):
+    """Time the enclosed block as the section `name` (only when metrics are enabled)."""
+    if not enabled:
+        yield
+        return
+    t0 = time.perf_counter()
+    try:
+        yield
+    finally:
+        observe('section_ms', name, (time.perf_counter() - t0) * 1e3)
+
+@contextlib.contextmanager
+def interaction(model, name):
+    """Time the enclosed callback body and, when metrics are enabled, measure the patch it
+    sends to the browser."""
+    doc = model.document if enabled else None
+    events = []
+    if doc is not None:
+        doc.on_change(events.append)
+    t0 = time.perf_counter()
+    try:
+        yield
+    finally:
+        ms = (time.perf_counter() - t0) * 1e3
+        if doc is not None:
+            doc.remove_on_change(events.append)
+        record = Interaction(ms, len(events), patch_bytes(events))
+        history[name].append(record)
+        if enabled:
+            observe('callback_ms', name, record.ms)
+            observe('patch_bytes', name, record.bytes)
+        log.log(logging.WARNING if ms > latency_budget_ms else logging.DEBUG,
+                '%s: %.1f ms, %d changes, %d bytes patch', name, record.ms, record.events, record.bytes)
+
+def record_document(doc):
+    """Record the number of models and the JSON size of a new session's document.
+
+    Measurement only: bokeh serializes the document for the browser on its own, and this
+    serializes it a second time, timed as the section extra_serialization.
+    """
+    if not enabled:
+        return
+    with section('extra_serialization'):
+        payload = doc.to_json_string()
+    observe('document_models', 'session', sum(len(root.references()) for root in doc.roots))
+    observe('document_bytes', 'session', len(payload.encode('utf-8')))
+
+###########################################
+## Reporting
+
+def exposition():
+    """Every histogram in the Prometheus text format."""
+    lines = []
+    for metric in sorted({m for m, _ in metrics}):
+        name = 'ew_{}'.format(metric)
+        lines.append('# TYPE {} histogram'.format(name))
+        for (m, label), h in sorted(metrics.items()):
+            if m != metric:
+                continue
+            cumulative = 0
+            for bound, count in zip(h.bounds + ['+Inf'], h.counts):
+                cumulative += count
+                lines.append('{}_bucket{{name="{}",le="{}"}} {}'.format(name, label, bound, cumulative))
+            lines.append('{}_sum{{name="{}"}} {}'.format(name, label, h.sum))
+            lines.append('{}_count{{name="{}"}} {}'.format(name, label, h.count))
+    return '\n'.join(lines) + '\n'
+
+def summary():
+    """One line with the count, mean and max of every histogram."""
+    return '; '.join('{} {} n={} mean={:.1f} max={:.1f}'.format(m, label, h.count, h.sum / h.count, h.max)
+                     for (m, label), h in sorted(metrics.items()) if h.count)
+
+def log_summary():
+    if metrics:
+        log.info('metrics: %s', summary())
+
+def handlers():
+    """Tornado handlers of the local metrics server."""
+    class MetricsHandler(tornado.web.RequestHandler):
+        def get(self):
+            self.set_header('Content-Type', 'text/plain; version=0.0.4')
+            self.write(exposition())
+
+    return [(r'/metrics', MetricsHandler)]
+
+def worker_port(port):
+    """`port` offset by the index of this worker (EW_WORKER, set by serve.py) when the
+    server runs several worker processes."""
+    return port + int(os.environ.get('EW_WORKER', 0))
+
+def start(server_context):
+    """Start the periodic summary line and the /metrics endpoint, if metrics are enabled."""
+    if not enabled:
+        return
+    interval = float(os.environ.get('EW_METRICS_LOG_INTERVAL', 60))
+    if server_context is not None and interval > 0:
+        tornado.ioloop.PeriodicCallback(log_summary, interval * 1e3).start()
+    port = os.environ.get('EW_METRICS_PORT')
+    if port:
+        port = worker_port(int(port))
+        tornado.web.Application(handlers()).listen(port, address='127.0.0.1')
+        log.info('metrics served at http://127.0.0.1:%d/metrics', port)
@@ -0,0 +1,139 @@
+# -*- coding: utf-8 -*-
+"""
+Session lifecycle: idle timeout, release of closed sessions and graceful drain.
+
+main.py registers every new session with `open_session`. A session without any document
+change (from the browser or from its callbacks) for EW_SESSION_IDLE_TIMEOUT seconds
+(default 1800, 0 to disable) is expired: its dashboard models are released and replaced
+by a notice asking to reload the page. Sessions closed by the browser are destroyed by
+the bokeh server (see its --unused-session-lifetime option) and then dropped from
+`sessions` by the on_session_destroyed hook.
+
+Draining stops serving the dashboard to new sessions (they get a notice instead) and
+stops the server once every session showing the dashboard has been closed or expired.
+With EW_ADMIN_TOKEN set, `start` serves on 127.0.0.1:EW_ADMIN_PORT (default 5008):
+    GET  /admin/status   {"draining": ..., "sessions": ..., "opened": ...}
+    POST /admin/drain    start draining
+both requiring an "Authorization: Bearer <EW_ADMIN_TOKEN>" header. Worker i of a
+multi-process server serves them at EW_ADMIN_PORT + i and drains on its own.
+
+"""
+
+# imports
+import hmac
+import json
+import logging
+import os
+import time
+import tornado.ioloop
+import tornado.web
+from bokeh.models.widgets.markups import Div
+import instrument
+
+log = logging.getLogger(__name__)
+
+idle_timeout_s = float(os.environ.get('EW_SESSION_IDLE_TIMEOUT', 1800))
+admin_token = os.environ.get('EW_ADMIN_TOKEN')
+admin_port = int(os.environ.get('EW_ADMIN_PORT', 5008))
+draining = False
+# documents built since the server started
+opened = 0
+# session id -> document, for the sessions showing the dashboard
+sessions = {}
+# session id -> (on_change hook, periodic callback) of its idle check
+idle_checks = {}
+
+###########################################
+## Sessions
+
+def notice(text):
+    return Div(text="""<p style="font-size:16px">{}</p>""".format(text))
+
+def open_session(doc):
+    """Register a new session; False if the server is draining (the session then only
+    shows a notice and the dashboard must not be built)."""
+    if draining:
+        doc.add_root(notice('The server is restarting. Please reload the page in a few minutes.'))
+        return False
+    global opened
+    opened += 1
+    session_id = doc.session_context.id
+    sessions[session_id] = doc
+    if idle_timeout_s > 0:
+        last_change = [time.monotonic()]
+
+        def on_change(event):
+            last_change[0] = time.monotonic()
+
+        def check_idle():
+            if time.monotonic() - last_change[0] > idle_timeout_s:
+                expire(session_id)
+
+        doc.on_change(on_change)
+        idle_checks[session_id] = on_change, doc.add_periodic_callback(check_idle, min(idle_timeout_s, 60) * 1e3)
+    return True
+
+def expire(session_id):
+    """Release the dashboard models of an idle session, leaving a notice in its place."""
+    doc = sessions.pop(session_id, None)
+    if doc is None:
+        return
+    if session_id in idle_checks:
+        on_change, callback = idle_checks.pop(session_id)
+        doc.remove_on_change(on_change)
+        doc.remove_periodic_callback(callback)
+    doc.clear()
+    doc.add_root(notice('This session was closed after {:.0f} minutes without activity. '
+                        'Reload the page to start a new one.'.format(idle_timeout_s / 60)))
+    log.info('session %s expired, %d open', session_id, len(sessions))
+    check_drained()
+
+def session_destroyed(session_id):
+    """Forget a session destroyed by the server (its document is already released)."""
+    sessions.pop(session_id, None)
+    idle_checks.pop(session_id, None)
+    check_drained()
+
+###########################################
+## Drain
+
+def drain():
+    global draining
+    if not draining:
+        draining = True
+        log.warning('draining: %d sessions open', len(sessions))
+    check_drained()
+
+def check_drained():
+    if draining and not sessions:
+        log.warning('drained, stopping the server')
+        loop = tornado.ioloop.IOLoop.current()
+        loop.add_callback(loop.stop)
+
+def status():
+    return {'draining': draining, 'sessions': len(sessions), 'opened': opened}
+
+class AdminHandler(tornado.web.RequestHandler):
+    def prepare(self):
+        given = self.request.headers.get('Authorization', '')
+        if not admin_token or not hmac.compare_digest(given.encode(), 'Bearer {}'.format(admin_token).encode()):
+            raise tornado.web.HTTPError(403)
+
+class StatusHandler(AdminHandler):
+    def get(self):
+        self.write(json.dumps(status()))
+
+class DrainHandler(AdminHandler):
+    def post(self):
+        drain()
+        self.write(json.dumps(status()))
+
+def handlers():
+    return [(r'/admin/status', StatusHandler), (r'/admin/drain', DrainHandler)]
+
+def start(server_context):
+    """Serve the admin endpoints, if EW_ADMIN_TOKEN is set."""
+    if admin_token and server_context is not None:
+        port = instrument.worker_port(admin_port)
+        tornado.web.Application(handlers()).listen(port, address='127.0.0.1')
+        log.info('admin endpoints at http://127.0.0.1:%d/admin', port)
@@ -0,0 +1,235 @@
+# -*- coding: utf-8 -*-
+"""
+Load tests against a local bokeh server started with serve.py.
+
+Churn (default): opens and closes `--sessions` sessions with bokeh.client in batches of
+`--batch`. After each batch it waits for the server to discard the closed sessions and
+reads the resident memory of the server (VmRSS in /proc). The test fails if RSS grows by
+more than `--tolerance-mb` over the level reached after a warm-up batch, or if sessions
+are still registered once all are closed. It then drains the server through the admin
+endpoint and checks that it exits.
+
+Throughput (`--workers`): for each number of worker processes, opens `--sessions`
+sessions from `--concurrency` client processes and reports sessions/sec, the median and
+p95 latency of creating a session, the documents the workers built per session (1 when
+the page request and the websocket of a session reach the same worker), and the memory
+of all workers: RSS counts shared pages once per worker, PSS splits them between the
+workers sharing them.
+
+Sessions are opened as a browser does (`visit`): a GET of the page, which creates the
+session, then its websocket, which pulls the document.
+
+Usage:
+    python loadtest.py                                    # churn, 300 sessions in batches of 50
+    python loadtest.py --workers 1 2 4 --concurrency 16   # throughput against worker count
+
+"""
+
+# imports
+import argparse
+import concurrent.futures
+import glob
+import json
+import os
+import re
+import subprocess
+import sys
+import time
+import urllib.error
+import urllib.request
+import numpy as np
+from bokeh.client import pull_session
+from bokeh.util.token import get_session_id
+from lod import require
+
+here = os.path.dirname(os.path.abspath(__file__))
+
+# sessions without a connection are discarded this long after, checked this often (ms):
+# long enough for the websocket of a loaded page to connect on a busy server, which
+# would otherwise build the document of a discarded session again
+unused_session_lifetime = 5000
+check_unused_sessions = 1000
+
+###########################################
+## Server
+
+def start_server(port, admin_port, token, workers=1, worker_port=5210):
+    env = dict(os.environ, EW_ADMIN_TOKEN=token, EW_ADMIN_PORT=str(admin_port))
+    cmd = [sys.executable, os.path.join(here, 'serve.py'), '--num-procs', str(workers), '--port', str(port),
+           '--worker-port', str(worker_port), '--unused-session-lifetime', str(unused_session_lifetime),
+           '--check-unused-sessions', str(check_unused_sessions)]
+    return subprocess.Popen(cmd, env=env, stdout=subprocess.DEVNULL, stderr=subprocess.PIPE)
+
+def admin(port, token, path, method='GET'):
+    request = urllib.request.Request('http://127.0.0.1:{}/admin/{}'.format(port, path), method=method,
+                                     headers={'Authorization': 'Bearer {}'.format(token)})
+    with urllib.request.urlopen(request, data=b'' if method == 'POST' else None, timeout=10) as response:
+        return json.load(response)
+
+def wait_ready(admin_port, token, server, workers=1, timeout=60):
+    """Wait until every worker answers on its admin port (admin_port + worker index)."""
+    t0 = time.time()
+    ready = set()
+    while time.time() - t0 < timeout:
+        if server.poll() is not None:
+            raise RuntimeError('server exited:\n' + server.stderr.read().decode())
+        for i in set(range(workers)) - ready:
+            try:
+                admin(admin_port + i, token, 'status')
+                ready.add(i)
+            except (urllib.error.URLError, ConnectionError):
+                pass
+        if len(ready) == workers:
+            return
+        time.sleep(.2)
+    raise RuntimeError('server not ready after {}s'.format(timeout))
+
+def open_sessions(admin_port, token, workers=1):
+    return sum(admin(admin_port + i, token, 'status')['sessions'] for i in range(workers))
+
+def built_documents(admin_port, token, workers=1):
+    return sum(admin(admin_port + i, token, 'status')['opened'] for i in range(workers))
+
+def settle(admin_port, token, workers=1, timeout=30):
+    """Wait until the server has discarded every closed session."""
+    t0 = time.time()
+    while time.time() - t0 < timeout:
+        if open_sessions(admin_port, token, workers) == 0:
+            return True
+        time.sleep((unused_session_lifetime + check_unused_sessions) / 1e3)
+    return False
+
+def shutdown(admin_port, token, server, workers=1):
+    """Drain every worker and return the exit code of the server."""
+    for i in range(workers):
+        admin(admin_port + i, token, 'drain', method='POST')
+    return server.wait(timeout=30)
+
+###########################################
+## Memory
+
+def processes(pid):
+    """`pid` and its descendants."""
+    pids = [pid]
+    for path in glob.glob('/proc/{}/task/*/children'.format(pid)):
+        with open(path) as f:
+            for child in f.read().split():
+                pids += processes(int(child))
+    return pids
+
+def memory_mb(pid, field='Rss'):
+    """Sum of `field` (Rss or Pss) over `pid` and its descendants, in MB."""
+    total = 0
+    for p in processes(pid):
+        try:
+            with open('/proc/{}/smaps_rollup'.format(p)) as f:
+                total += sum(int(line.split()[1]) for line in f if line.startswith(field + ':'))
+        except OSError:
+            pass
+    return total / 1024
+
+###########################################
+## Clients
+
+def visit(url):
+    """Open a session as a browser does: GET the page (the server creates the session and
+    embeds its token), then connect the session's websocket and pull its document."""
+    with urllib.request.urlopen(url, timeout=30) as response:
+        page = response.read().decode('utf-8')
+    token = re.search(r'"token":\s*"([^"]+)"', page).group(1)
+    return pull_session(session_id=get_session_id(token), url=url)
+
+def churn(url, n):
+    """Open and close `n` sessions one after the other; seconds per session."""
+    t0 = time.perf_counter()
+    for _ in range(n):
+        session = visit(url)
+        session.close()
+    return (time.perf_counter() - t0) / n
+
+def session_latencies(url, n):
+    """Open and close `n` sessions; seconds to create each one."""
+    latencies = []
+    for _ in range(n):
+        t0 = time.perf_counter()
+        session = visit(url)
+        latencies.append(time.perf_counter() - t0)
+        session.close()
+    return latencies
+
+def throughput(url, sessions, concurrency):
+    """Sessions/sec and session creation latencies with `concurrency` client processes."""
+    counts = [len(part) for part in np.array_split(np.arange(sessions), concurrency)]
+    with concurrent.futures.ProcessPoolExecutor(concurrency) as clients:
+        # start the client processes before timing
+        list(clients.map(time.sleep, [0] * concurrency))
+        t0 = time.perf_counter()
+        latencies = sum(clients.map(session_latencies, [url] * concurrency, counts), [])
+        elapsed = time.perf_counter() - t0
+    return sessions / elapsed, np.array(latencies)
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Load tests against a local bokeh server.')
+    parser.add_argument('--sessions', type=int, default=300)
+    parser.add_argument('--batch', type=int, default=50, help='churn: sessions between memory readings')
+    parser.add_argument('--tolerance-mb', type=float, default=20, help='churn: allowed RSS growth')
+    parser.add_argument('--workers', type=int, nargs='+', help='throughput: worker counts to compare')
+    parser.add_argument('--concurrency', type=int, default=8, help='throughput: client processes')
+    parser.add_argument('--port', type=int, default=5206)
+    parser.add_argument('--admin-port', type=int, default=5300)
+    parser.add_argument('--worker-port', type=int, default=5210, help='throughput: port of the first worker')
+    args = parser.parse_args()
+
+    token = os.urandom(16).hex()
+    url = 'http://localhost:{}/{}'.format(args.port, os.path.basename(here))
+
+    if args.workers:
+        print('{:>8}{:>14}{:>10}{:>10}{:>12}{:>10}{:>10}'.format(
+            'workers', 'sessions/s', 'p50 ms', 'p95 ms', 'docs/sess', 'RSS MB', 'PSS MB'))
+        for workers in args.workers:
+            server = start_server(args.port, args.admin_port, token, workers, args.worker_port)
+            try:
+                wait_ready(args.admin_port, token, server, workers)
+                throughput(url, args.concurrency, args.concurrency)
+                built = built_documents(args.admin_port, token, workers)
+                rate, latencies = throughput(url, args.sessions, args.concurrency)
+                per_session = (built_documents(args.admin_port, token, workers) - built) / args.sessions
+                settle(args.admin_port, token, workers)
+                print('{:>8}{:>14.1f}{:>10.0f}{:>10.0f}{:>12.2f}{:>10.1f}{:>10.1f}'.format(
+                    workers, rate, np.percentile(latencies, 50) * 1e3, np.percentile(latencies, 95) * 1e3,
+                    per_session, memory_mb(server.pid), memory_mb(server.pid, 'Pss')))
+                shutdown(args.admin_port, token, server, workers)
+            finally:
+                if server.poll() is None:
+                    server.terminate()
+                    server.wait()
+        raise SystemExit(0)
+
+    server = start_server(args.port, args.admin_port, token)
+    try:
+        wait_ready(args.admin_port, token, server)
+        # warm-up: imports, caches and allocator pools reach their working size
+        churn(url, args.batch)
+        require(settle(args.admin_port, token), 'closed sessions were not released')
+        baseline = memory_mb(server.pid)
+        print('{:>10}{:>12}{:>12}'.format('sessions', 'ms/session', 'RSS MB'))
+        print('{:>10}{:>12}{:>12.1f}'.format('warm-up', '', baseline))
+        done = 0
+        while done < args.sessions:
+            n = min(args.batch, args.sessions - done)
+            per_session = churn(url, n)
+            done += n
+            require(settle(args.admin_port, token), 'closed sessions were not released')
+            print('{:>10}{:>12.1f}{:>12.1f}'.format(done, per_session * 1e3, memory_mb(server.pid)))
+        growth = memory_mb(server.pid) - baseline
+        require(growth <= args.tolerance_mb, 'RSS grew by {:.1f} MB over {} sessions'.format(growth, args.sessions))
+
+        # graceful shutdown: drain, then the server stops by itself
+        code = shutdown(args.admin_port, token, server)
+        require(code == 0, 'server exited with code {}'.format(code))
+        print('ok: RSS grew by {:.1f} MB over {} sessions; drained and exited'.format(growth, args.sessions))
+    finally:
+        if server.poll() is None:
+            server.terminate()
+            server.wait()
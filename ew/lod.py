@@ -0,0 +1,288 @@
+# -*- coding: utf-8 -*-
+"""
+Level of detail for long time series.
+
+At monthly or weekly granularity a source can hold far more points than the figures
+have pixels. `LevelOfDetail` keeps the full-resolution columns on the server and sends
+the browser only a decimated view of the visible x window (plus a margin for panning),
+recomputed on RangesUpdate events, debounced so that a zoom gesture triggers one update.
+
+Two decimations are provided, both keeping every column of a wide source aligned on the
+same rows:
+    minmax   two rows per bucket with the min and max of every column, in the order
+             they occur (extremes and whisker envelopes are preserved)
+    lttb     Largest-Triangle-Three-Buckets on one key column, whose rows are then
+             taken from every column
+
+Usage:
+    python lod.py            # benchmark on 1M points per series
+    python lod.py --check    # check both decimations and a LevelOfDetail in a Document
+
+"""
+
+# imports
+import argparse
+import time
+import numpy as np
+from bokeh.events import RangesUpdate
+import instrument
+
+
+###########################################
+## Decimation
+
+def minmax(data, x, n_buckets):
+    """Decimate the columns of `data` (sorted by `x`) to two rows per bucket."""
+    m = len(data[x])
+    if m <= 2 * n_buckets:
+        return dict(data)
+    size = -(-m // n_buckets)
+    n_buckets = -(-m // size)
+    pad = n_buckets * size - m
+
+    def buckets(values, fill):
+        return np.concatenate([values, np.full(pad, fill)]).reshape(n_buckets, size)
+
+    first = np.arange(n_buckets) * size
+    last = np.minimum(first + size, m) - 1
+    out = {x: np.column_stack([data[x][first], data[x][last]]).ravel()}
+    for col, values in data.items():
+        if col == x:
+            continue
+        values = values.astype(float)
+        imin = np.argmin(buckets(np.where(np.isnan(values), np.inf, values), np.inf), axis=1)
+        imax = np.argmax(buckets(np.where(np.isnan(values), -np.inf, values), -np.inf), axis=1)
+        b = buckets(values, np.nan)
+        vmin = b[np.arange(n_buckets), imin]
+        vmax = b[np.arange(n_buckets), imax]
+        min_first = imin <= imax
+        out[col] = np.column_stack([np.where(min_first, vmin, vmax), np.where(min_first, vmax, vmin)]).ravel()
+    return out
+
+def lttb_indices(x, y, n):
+    """Rows kept by Largest-Triangle-Three-Buckets when reducing (x, y) to `n` points.
+
+    Vectorized variant: each bucket's triangle is anchored on the averages of the previous
+    and next buckets (instead of on the point selected in the previous bucket), so that
+    all buckets are solved at once.
+    """
+    m = len(x)
+    if n >= m or n < 3:
+        return np.arange(m)
+    x = x.astype(float)
+    y = np.nan_to_num(y.astype(float), nan=np.nanmean(y))
+    # n - 2 buckets over the interior points; the first and last points are always kept
+    edges = np.linspace(1, m - 1, n - 1).astype(int)
+    counts = np.diff(edges)
+    avg_x = np.concatenate([[x[0]], np.add.reduceat(x[:m - 1], edges[:-1]) / counts, [x[-1]]])
+    avg_y = np.concatenate([[y[0]], np.add.reduceat(y[:m - 1], edges[:-1]) / counts, [y[-1]]])
+    bucket = np.repeat(np.arange(n - 2), counts)
+    ax, ay = avg_x[bucket], avg_y[bucket]
+    cx, cy = avg_x[bucket + 2], avg_y[bucket + 2]
+    px, py = x[1:m - 1], y[1:m - 1]
+    area = np.abs((ax - cx) * (py - ay) - (ax - px) * (cy - ay))
+    # first row of each bucket reaching the bucket's largest area
+    best = np.flatnonzero(area == np.repeat(np.maximum.reduceat(area, edges[:-1] - 1), counts))
+    first = np.unique(bucket[best], return_index=True)[1]
+    return np.concatenate([[0], best[first] + 1, [m - 1]])
+
+def lttb(data, x, n, key):
+    """Rows of `data` selected by LTTB on the column `key`."""
+    rows = lttb_indices(data[x], data[key], n)
+    return {col: values[rows] for col, values in data.items()}
+
+###########################################
+## Server-side view
+
+class LevelOfDetail:
+    """Feed `source` with a decimated view of full-resolution columns that follows `x_range`.
+
+    `attach` the figures drawing from the source; their RangesUpdate events schedule an
+    update `debounce_ms` after the last one. Views have about two points per pixel of the
+    widest attached figure. Data small enough to be sent whole is sent once, untouched.
+    """
+
+    def __init__(self, source, x_range, x='pyear', method='minmax', key=None, debounce_ms=150, name='lod'):
+        self.source = source
+        self.x_range = x_range
+        self.x = x
+        self.method = method
+        self.key = key
+        self.debounce_ms = debounce_ms
+        self.name = name
+        self.width = 1000
+        self.data = None
+        self._full = False
+        self._window = None
+        self._timeout = None
+
+    def attach(self, *figs):
+        self.width = max(fig.plot_width or 0 for fig in figs) or self.width
+        for fig in figs:
+            fig.on_event(RangesUpdate, self._on_ranges_update)
+
+    def set_data(self, data):
+        """Replace the full-resolution columns (e.g. on a change of granularity), keeping
+        the current x window."""
+        self.data = data
+        self._full = False
+        self.show(*self.window())
+
+    def window(self):
+        """The visible x window, or (None, None) while the range has not been set."""
+        start, end = self.x_range.start, self.x_range.end
+        if start is None or end is None or not np.isfinite(start) or not np.isfinite(end):
+            return None, None
+        return start, end
+
+    def view(self, start, end):
+        """Decimated columns for the window [start, end] (everything if either is None)."""
+        x = self.data[self.x]
+        if len(x) <= 2 * self.width:
+            return dict(self.data), True
+        i0, i1, n = 0, len(x), 2 * self.width
+        if start is not None and end is not None:
+            # half a window of margin on each side, so that panning does not show a gap
+            margin = (end - start) / 2
+            i0 = max(np.searchsorted(x, start - margin, 'left') - 1, 0)
+            i1 = min(np.searchsorted(x, end + margin, 'right') + 1, len(x))
+            n = 4 * self.width
+        window = {col: values[i0:i1] for col, values in self.data.items()}
+        if self.method == 'lttb':
+            return lttb(window, self.x, n, self.key), False
+        return minmax(window, self.x, n // 2), False
+
+    def show(self, start, end):
+        """Send the view of [start, end] to the browser, unless nothing would change."""
+        if self.data is None or (self._full and len(self.data[self.x]) <= 2 * self.width):
+            return
+        with instrument.interaction(self.source, self.name):
+            self.source.data, self._full = self.view(start, end)
+
+    def _on_ranges_update(self, event):
+        self._window = (event.x0, event.x1)
+        doc = self.source.document
+        if doc is None:
+            self._apply()
+            return
+        if self._timeout is not None:
+            try:
+                doc.remove_timeout_callback(self._timeout)
+            except ValueError:
+                pass
+        self._timeout = doc.add_timeout_callback(self._apply, self.debounce_ms)
+
+    def _apply(self):
+        self._timeout = None
+        self.show(*self._window)
+
+###########################################
+## Checks
+
+def require(condition, message):
+    # explicit errors rather than asserts, which python -O skips
+    if not condition:
+        raise RuntimeError('check failed: {}'.format(message))
+
+def check(data, width):
+    """Check the decimations on `data` (pyear plus value columns, more than 4 * `width`
+    rows) and drive a LevelOfDetail with RangesUpdate events in a Document."""
+    from bokeh.document import Document
+    from bokeh.plotting import ColumnDataSource, figure
+
+    x = data['pyear']
+    n = len(x)
+    out = minmax(data, 'pyear', width)
+    require(len(out['pyear']) <= 2 * width, 'minmax returns at most two rows per bucket')
+    require(np.all(np.diff(out['pyear']) >= 0), 'minmax keeps x sorted')
+    for col in data:
+        require(len(out[col]) == len(out['pyear']), 'minmax keeps the columns aligned')
+        if col != 'pyear':
+            require(np.nanmin(out[col]) == np.nanmin(data[col]) and np.nanmax(out[col]) == np.nanmax(data[col]),
+                    'minmax keeps the extremes of {}'.format(col))
+    rows = lttb_indices(x, data['y1'], 2 * width)
+    require(len(rows) == 2 * width and rows[0] == 0 and rows[-1] == n - 1, 'lttb keeps n rows and both ends')
+    require(np.all(np.diff(rows) > 0), 'lttb rows are increasing')
+
+    fig = figure(plot_width=width)
+    source = ColumnDataSource(data={col: [] for col in data})
+    fig.line('pyear', 'y1', source=source)
+    doc = Document()
+    doc.add_root(fig)
+    detail = LevelOfDetail(source, fig.x_range)
+    detail.attach(fig)
+    require(detail.width == width, 'attach reads the plot width')
+
+    # small data is sent once, whole, and then never again
+    small = {col: values[:2 * width] for col, values in data.items()}
+    detail.set_data(small)
+    require(source.data['pyear'] is small['pyear'], 'small data is sent untouched')
+    events = []
+    doc.on_change(events.append)
+    detail.show(x[0], x[10])
+    doc.remove_on_change(events.append)
+    require(not events, 'showing small data again sends nothing')
+
+    # the full range, then windows with half a window of margin on each side
+    detail.set_data(data)
+    require(len(source.data['pyear']) <= 2 * width, 'full range at screen resolution')
+    start, end = x[n // 3], x[n // 2]
+    margin = (end - start) / 2
+    view, full = detail.view(start, end)
+    require(not full and len(view['pyear']) <= 4 * width, 'window at screen resolution')
+    require(view['pyear'][0] <= start - margin and view['pyear'][-1] >= end + margin, 'window covers the margins')
+    step = x[1] - x[0]
+    require(view['pyear'][0] >= start - margin - 2 * step and view['pyear'][-1] <= end + margin + 2 * step,
+            'window stops at the margins')
+
+    # RangesUpdate events are debounced into a single update, for the last window
+    for i in range(5):
+        fig._trigger_event(RangesUpdate(fig, x0=x[n // 10 * i], x1=x[n // 10 * (i + 1)]))
+    require(len(doc.session_callbacks) == 1, 'one pending update after a burst of events')
+    require(doc.session_callbacks[0].timeout == detail.debounce_ms, 'update after debounce_ms')
+    before = source.data
+    doc.session_callbacks[0].callback()
+    require(source.data is not before, 'the pending update sends a view')
+    x0, x1 = x[n // 10 * 4], x[n // 10 * 5]
+    require(source.data['pyear'][0] <= x0 and source.data['pyear'][-1] >= x1 and
+            source.data['pyear'][-1] - source.data['pyear'][0] <= 2.1 * (x1 - x0), 'the update shows the last window')
+
+    # new data keeps the current window
+    fig.x_range.start, fig.x_range.end = x0, x1
+    detail.set_data({col: values.copy() for col, values in data.items()})
+    require(source.data['pyear'][0] >= x0 - (x1 - x0) and source.data['pyear'][-1] <= x1 + (x1 - x0),
+            'set_data keeps the zoomed window')
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Benchmark or check the level-of-detail decimations.')
+    parser.add_argument('--points', type=int, default=1000000, help='points per series')
+    parser.add_argument('--series', type=int, default=8, help='columns of the wide source')
+    parser.add_argument('--width', type=int, default=1000, help='plot width in pixels')
+    parser.add_argument('--check', action='store_true')
+    args = parser.parse_args()
+
+    rng = np.random.default_rng(0)
+    x = 1986 + np.arange(args.points) / args.points * 15
+    data = {'pyear': x}
+    for j in range(args.series):
+        data['y{}'.format(j)] = np.cumsum(rng.normal(size=args.points))
+    data['y0'][rng.integers(0, args.points, 100)] = np.nan
+
+    if args.check:
+        check(data, args.width)
+        print('ok')
+        raise SystemExit(0)
+
+    raw = sum(v.nbytes for v in data.values())
+    print('{:,} points x {} series, {:,} bytes'.format(args.points, args.series, raw))
+    for label, start, end in [('full range', None, None), ('1 year', 1990, 1991), ('1 month', 1990, 1990 + 1 / 12)]:
+        for method in ['minmax', 'lttb']:
+            lod = LevelOfDetail(None, None, method=method, key='y1')
+            lod.width = args.width
+            lod.data = data
+            t0 = time.perf_counter()
+            view, _ = lod.view(start, end)
+            ms = (time.perf_counter() - t0) * 1e3
+            print('{:<12}{:<8}{:>10.1f} ms{:>10,} rows{:>14,} bytes'.format(
+                label, method, ms, len(view['pyear']), sum(v.nbytes for v in view.values())))
@@ -0,0 +1,34 @@
+# -*- coding: utf-8 -*-
+"""
+Entry point of the bokeh server application (`bokeh serve ew`).
+
+Data loading and pre-aggregation happen once per process in app_hooks.py; under the
+server this script only builds the session's document (see lifecycle.py for its idle
+timeout and for draining).
+
+Run directly, it exports a static, server-less version of the dashboard instead:
+    python main.py --static [--out dist]
+
+"""
+
+from bokeh.io import curdoc
+import dashboard
+import instrument
+import lifecycle
+
+if __name__ == '__main__':
+    import argparse
+    import app_hooks
+    import static
+    parser = argparse.ArgumentParser(description='Export the dashboard without a bokeh server.')
+    parser.add_argument('--static', action='store_true', required=True, help='write a static html/json bundle')
+    parser.add_argument('--out', default='dist', help='output directory')
+    args = parser.parse_args()
+    app_hooks.on_server_loaded(None)
+    static.report(static.build(args.out))
+else:
+    bokeh_doc = curdoc()
+    bokeh_doc.title = dashboard.title
+    if lifecycle.open_session(bokeh_doc):
+        bokeh_doc.add_root(dashboard.layout())
+        instrument.record_document(bokeh_doc)
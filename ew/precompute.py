@@ -0,0 +1,308 @@
+# -*- coding: utf-8 -*-
+"""
+Process-wide precomputed data for the dashboard.
+
+Bokeh re-executes the dashboard script for every session, but the modules it imports
+stay in sys.modules. Everything cached here is therefore built once per server process
+and then shared, read-only, by all sessions: sessions only wrap the cached columns in
+their own ColumnDataSources.
+
+Each dataset of registry.py is loaded into a `Data` on first use and kept in `loaded`, a
+least-recently-used cache bounded by EW_DATASET_CACHE_MB (default 512) of loaded and
+derived arrays. The module-level functions read the default dataset.
+
+Usage:
+    python precompute.py  # time the per-session merge loop against the cached pivot
+
+"""
+
+# imports
+import collections
+import functools
+import logging
+import os
+import time
+import numpy as np
+import pandas as pd
+import aggregate
+import datastore
+import instrument
+import registry
+
+log = logging.getLogger(__name__)
+
+
+###########################################
+## Settings
+# quantile bins of the Tab III pyramid, finest first; each divides the previous one
+resolutions = [100, 20, 10, 5]
+# time granularities of the Tab I/II charts and their tables (with a `_nbercat` twin)
+granularities = {'Year': 'df_year', 'Month': 'df_month', 'Week': 'df_week'}
+# loaded datasets are evicted, least recently used first, beyond this size
+cache_mb = float(os.environ.get('EW_DATASET_CACHE_MB', 512))
+
+def _columns(df, copy=True):
+    """Read-only numpy columns of `df`, ready to be handed to a ColumnDataSource.
+
+    The columns of a loaded table (copy=False) are its read-only memory maps, whose pages
+    every session and worker process shares; derived frames are materialized once.
+    """
+    data = {}
+    for col in df.columns:
+        values = df[col].to_numpy()
+        if copy:
+            values = np.array(values)
+            values.flags.writeable = False
+        data[str(col)] = values
+    return data
+
+def _nbytes(value):
+    """Heap bytes of the arrays and frames in `value`, a nest of dicts, lists and tuples
+    (memory-mapped columns are file-backed and not counted)."""
+    if isinstance(value, np.ndarray):
+        return 0 if isinstance(value, np.memmap) or isinstance(value.base, np.memmap) else value.nbytes
+    if isinstance(value, pd.DataFrame):
+        return int(value.memory_usage(index=False).sum())
+    if isinstance(value, dict):
+        return sum(_nbytes(v) for v in value.values())
+    if isinstance(value, (list, tuple)):
+        return sum(_nbytes(v) for v in value)
+    return 0
+
+def memoized(method):
+    """Cache the results of a method of Data on the instance, so they go with it when the
+    dataset is evicted."""
+    @functools.wraps(method)
+    def wrapper(self, *args):
+        key = (method.__name__,) + args
+        if key not in self._memo:
+            self._memo[key] = method(self, *args)
+        return self._memo[key]
+    return wrapper
+
+###########################################
+## Cached data
+
+class Data:
+    """The tables of a registered dataset and every frame derived from them.
+
+    Sessions only read them: they wrap the cached columns in their own ColumnDataSources.
+    """
+
+    def __init__(self, dataset):
+        self.dataset = dataset
+        names = datastore.tables + datastore.available(datastore.optional_tables, dataset.csv_dir)
+        datastore.build(names, csv=dataset.csv_dir, cache=dataset.cache_dir)
+        self.tables = datastore.load_tables(names, check=False, csv=dataset.csv_dir, cache=dataset.cache_dir)
+        registry.validate(dataset, self.tables)
+        self._memo = {}
+
+    def warm(self):
+        """Build every frame a session may ask for."""
+        self.hist_index()
+        self.pyramid()
+        self.nbercats()
+        for name in self.available_granularities().values():
+            self.table_data(name)
+            self.table_data('{}_nbercat_wide'.format(name))
+        for name in datastore.tables:
+            self.table_data(name)
+        return self
+
+    def nbytes(self):
+        return _nbytes(list(self._memo.values()))
+
+    def structure(self):
+        """What the models of a session's tabs depend on: datasets with the same structure
+        can be swapped into them in place. Column names (bound suffixes included) and labels
+        (figure titles, legends, category checkboxes) are part of it."""
+        ds = self.dataset
+        return (tuple(ds.counts.items()), tuple(ds.metrics.items()), tuple(ds.short_labels.items()),
+                tuple(ds.heatmap_metrics), ds.ci, tuple(ds.categories.items()), tuple(self.nbercats()),
+                tuple(self.available_granularities()), tuple(sorted(self.pyramid())), self.hist_index() is None)
+
+    @memoized
+    def nbercats(self):
+        return list(self.tables['df_year_nbercat'].nber_cat.unique())
+
+    @memoized
+    def available_granularities(self):
+        """The entries of `granularities` whose tables were built (Year always is)."""
+        return {label: name for label, name in granularities.items()
+                if name in self.tables and '{}_nbercat'.format(name) in self.tables}
+
+    @memoized
+    def nbercat_wide(self, name):
+        """A `_nbercat` table in wide format: one row per pyear, one `{var}_nbercat_{cat}`,
+        `{var}_low_nbercat_{cat}` and `{var}_hi_nbercat_{cat}` column per metric and category.
+        """
+        df = self.tables[name]
+        values = [c for c in df.columns if c not in ('pyear', 'nber_cat')]
+        wide = df.pivot(index='pyear', columns='nber_cat', values=values)
+        wide.columns = ['{}_nbercat_{}'.format(v, cat) for v, cat in wide.columns]
+        return wide.reset_index()
+
+    @memoized
+    def _table_data(self, name):
+        if name.endswith('_nbercat_wide'):
+            return _columns(self.nbercat_wide(name[:-len('_wide')]))
+        return _columns(self.tables[name], copy=False)
+
+    def table_data(self, name):
+        """Columns of a table (a loaded table, or '<table>_nbercat_wide' for the wide format
+        of a `_nbercat` table) for a session's ColumnDataSource. The arrays are shared by all
+        sessions; only the dict is new."""
+        return dict(self._table_data(name))
+
+    @memoized
+    def hist_index(self):
+        """Per-cell histograms of the heatmap metrics, or None if df_20_hist_* are missing.
+
+        {var: (left, right, counts)} where counts[fok_20, novelty_20] is the histogram of the
+        cell, so that looking up a clicked cell is a single array index.
+        """
+        index = {}
+        for var in self.dataset.heatmap_metrics:
+            df = self.tables.get('df_20_hist_{}'.format(var))
+            if df is None:
+                return None
+            q, nbins = aggregate.n_quantiles, int(df['bin'].max()) + 1
+            counts = np.zeros((q, q, nbins))
+            counts[df['fok_20'].to_numpy().astype(int), df['novelty_20'].to_numpy().astype(int),
+                   df['bin'].to_numpy()] = df['count'].to_numpy()
+            counts.flags.writeable = False
+            edges = df.drop_duplicates('bin').sort_values('bin')
+            index[var] = (edges['left'].to_numpy(), edges['right'].to_numpy(), counts)
+        return index
+
+    def _level(self, sums):
+        """Heatmap cells, fok -> novelty line and heatmap images of one pyramid level."""
+        q = len(sums['count'])
+        fok, nov = np.meshgrid(np.arange(q, dtype=float), np.arange(q, dtype=float), indexing='ij')
+        grid = pd.DataFrame({'fok_q': fok.ravel(), 'novelty_q': nov.ravel()})
+        images = {}
+        with np.errstate(invalid='ignore', divide='ignore'):
+            for var in self.dataset.heatmap_metrics:
+                mean = sums['{}_sum'.format(var)] / sums['count'] * (100 if var in self.dataset.percent_metrics else 1)
+                grid[var] = mean.ravel()
+                images[var] = mean.T.copy()  # image rows are novelty, columns fok
+                images[var].flags.writeable = False
+            # margins over novelty for the fok -> novelty line
+            n = sums['count'].sum(axis=1)
+            mean = sums['log_novelty_sum'].sum(axis=1) / n
+            std = np.sqrt((sums['log_novelty_sumsq'].sum(axis=1) - n * mean ** 2) / (n - 1))
+            half = aggregate.z * std / np.sqrt(n)
+        fok_nov = pd.DataFrame({'fok_q': np.arange(q, dtype=float), 'log_novelty': mean, 'count': n,
+                                'std': std, 'lower': mean - half, 'upper': mean + half})
+        return {'grid': _columns(grid), 'fok_nov': _columns(fok_nov), 'images': images}
+
+    @memoized
+    def pyramid(self):
+        """Multi-resolution fok x novelty aggregates for Tab III, {q: level} for q in `resolutions`.
+
+        The finest level comes from df_grid_100 (cell counts and sums, written by aggregate.py);
+        each coarser level is derived from the next finer one by summing blocks of cells, without
+        going back to the data. Without df_grid_100 only the 20-bin level of df_20/df_20_fok_nov
+        is available. A level holds the heatmap cells ('grid': fok_q, novelty_q and the cell means,
+        the percent metrics of the dataset in %), the fok -> novelty line ('fok_nov') and the cell means as (q, q)
+        arrays ('images').
+        """
+        heatmap_metrics = self.dataset.heatmap_metrics
+        base = self.tables.get('df_grid_{}'.format(resolutions[0]))
+        if base is None:
+            grid = self.tables['df_20'].rename(columns={'fok_20': 'fok_q', 'novelty_20': 'novelty_q'})
+            images = {}
+            for var in heatmap_metrics:
+                images[var] = np.full((20, 20), np.nan)
+                images[var][grid['novelty_q'].to_numpy().astype(int), grid['fok_q'].to_numpy().astype(int)] = grid[var].to_numpy()
+                images[var].flags.writeable = False
+            return {20: {'grid': _columns(grid),
+                         'fok_nov': _columns(self.tables['df_20_fok_nov'].rename(columns={'fok_20': 'fok_q'})),
+                         'images': images}}
+
+        q = resolutions[0]
+        cells = base['fok_{}'.format(q)].to_numpy().astype(int), base['novelty_{}'.format(q)].to_numpy().astype(int)
+        sums = {}
+        for col in ['count', 'log_novelty_sum', 'log_novelty_sumsq'] + ['{}_sum'.format(var) for var in heatmap_metrics]:
+            sums[col] = np.zeros((q, q))
+            sums[col][cells] = base[col].to_numpy()
+        levels = {}
+        for k in resolutions:
+            f = q // k
+            sums = {col: a.reshape(k, f, k, f).sum(axis=(1, 3)) for col, a in sums.items()}
+            q = k
+            levels[k] = self._level(sums)
+        return levels
+
+###########################################
+## Datasets
+
+# dataset name -> Data, least recently used first
+loaded = collections.OrderedDict()
+
+def load(name=None):
+    """The warmed-up Data of the registered dataset `name` (default: registry.default).
+
+    Loading a dataset evicts the least recently used ones while the loaded datasets take
+    more than `cache_mb`; the one just loaded always stays. Sessions showing an evicted
+    dataset keep it alive until they switch to another one or close.
+    """
+    name = name or registry.default
+    if name in loaded:
+        loaded.move_to_end(name)
+        return loaded[name]
+    t0 = time.perf_counter()
+    with instrument.section('data_load'):
+        data = loaded[name] = Data(registry.get(name)).warm()
+    log.info('dataset %s loaded in %.3fs (%.1f MB)', name, time.perf_counter() - t0, data.nbytes() / 2**20)
+    while len(loaded) > 1 and sum(d.nbytes() for d in loaded.values()) > cache_mb * 2**20:
+        evicted, _ = loaded.popitem(last=False)
+        log.info('dataset %s evicted', evicted)
+    return data
+
+# the default dataset, for the scripts that only use that one
+def tables(dataset=None):
+    return load(dataset).tables
+
+def nbercats(dataset=None):
+    return load(dataset).nbercats()
+
+def available_granularities(dataset=None):
+    return load(dataset).available_granularities()
+
+def hist_index(dataset=None):
+    return load(dataset).hist_index()
+
+def pyramid(dataset=None):
+    return load(dataset).pyramid()
+
+def table_data(name, dataset=None):
+    return load(dataset).table_data(name)
+
+if __name__ == '__main__':
+    dataset = registry.get()
+    df_year_nbercat = tables()['df_year_nbercat']
+    df_pyear = tables()['df_year'][['pyear']]
+
+    # what every session used to do: one filter/merge/rename per metric and category
+    t0 = time.perf_counter()
+    for v in list(dataset.counts) + list(dataset.metrics):
+        cols = ['pyear', v] + (list(registry.bounds(dataset, v)) if v in dataset.metrics else [])
+        df_i = df_pyear.copy()
+        for nbercat in nbercats():
+            df_i = df_i.merge(df_year_nbercat[df_year_nbercat['nber_cat']==nbercat][cols], on='pyear').rename(
+                columns={c: '{}_nbercat_{}'.format(c, nbercat) for c in cols if c != 'pyear'})
+    t_merge = time.perf_counter() - t0
+
+    fresh = Data(dataset)
+    t0 = time.perf_counter()
+    fresh.table_data('df_year_nbercat_wide')
+    t_first = time.perf_counter() - t0
+
+    t0 = time.perf_counter()
+    table_data('df_year_nbercat_wide')
+    t_cached = time.perf_counter() - t0
+
+    print('merge loop (per session, before): {:8.2f} ms'.format(t_merge * 1e3))
+    print('pivot (once per process):         {:8.2f} ms'.format(t_first * 1e3))
+    print('cached lookup (per session):      {:8.3f} ms'.format(t_cached * 1e3))
@@ -0,0 +1,92 @@
+# -*- coding: utf-8 -*-
+"""
+Registry of the datasets the dashboard can serve.
+
+Datasets are declared in datasets.json (and in the file named by EW_DATASETS, whose
+entries are added to or replace those of datasets.json), one entry per dataset:
+    title            shown in the dataset selector
+    csv_dir          folder of its tables, relative to this folder
+    counts           count column -> label (Tab I/II counts)
+    metrics          mean column -> label (Tab I/II lines and whiskers)
+    short_labels     labels of the narrower Tab I charts, where they differ
+    heatmap_metrics  metrics of the Tab III heatmaps and drill-down
+    percent_metrics  heatmap metrics that are rates, shown in % (optional)
+    categories       category code -> label (Tab II)
+    ci               suffixes of the lower and upper confidence bound columns
+    columns          table -> columns it must have besides those derived from the
+                     entries above (optional)
+The first dataset (or EW_DATASET) is the default one. `schema` lists the columns each
+table must have, which `validate` checks when a dataset is loaded.
+
+"""
+
+# imports
+import collections
+import json
+import os
+import datastore
+
+here = os.path.dirname(os.path.abspath(__file__))
+
+Dataset = collections.namedtuple('Dataset', ['name', 'title', 'csv_dir', 'cache_dir', 'counts', 'metrics',
+                                             'short_labels', 'heatmap_metrics', 'percent_metrics', 'categories',
+                                             'ci', 'columns'])
+
+
+def _code(key):
+    return int(key) if key.lstrip('-').isdigit() else key
+
+def read(path):
+    with open(path) as f:
+        entries = json.load(f, object_pairs_hook=collections.OrderedDict)
+    folder = os.path.dirname(os.path.abspath(path))
+    return collections.OrderedDict(
+        (name, Dataset(name=name,
+                       title=entry['title'],
+                       csv_dir=os.path.join(folder, entry['csv_dir']),
+                       cache_dir=os.path.join(datastore.cache_dir, name),
+                       counts=entry['counts'],
+                       metrics=entry['metrics'],
+                       short_labels=entry.get('short_labels', {}),
+                       heatmap_metrics=entry['heatmap_metrics'],
+                       percent_metrics=entry.get('percent_metrics', []),
+                       categories=collections.OrderedDict((_code(k), v) for k, v in entry['categories'].items()),
+                       ci=tuple(entry['ci']),
+                       columns=entry.get('columns', {})))
+        for name, entry in entries.items())
+
+datasets = read(os.path.join(here, 'datasets.json'))
+if os.environ.get('EW_DATASETS'):
+    datasets.update(read(os.environ['EW_DATASETS']))
+default = os.environ.get('EW_DATASET') or next(iter(datasets))
+
+def get(name=None):
+    return datasets[name or default]
+
+def label(dataset, var, short=False):
+    return (short and dataset.short_labels.get(var)) or dataset.metrics.get(var) or dataset.counts[var]
+
+def bounds(dataset, var):
+    """Lower and upper confidence bound columns of `var`."""
+    low, hi = dataset.ci
+    return var + low, var + hi
+
+###########################################
+## Schema
+
+def schema(dataset):
+    """Columns required in each table of `dataset`."""
+    means = [c for var in dataset.metrics for c in (var,) + bounds(dataset, var)]
+    columns = {'df_year': ['pyear'] + list(dataset.counts) + means,
+               'df_year_nbercat': ['pyear', 'nber_cat'] + list(dataset.counts) + means,
+               'df_20': ['fok_20', 'novelty_20'] + list(dataset.heatmap_metrics)}
+    for name, cols in dataset.columns.items():
+        columns[name] = columns.get(name, []) + list(cols)
+    return columns
+
+def validate(dataset, tables):
+    """Raise a ValueError naming the columns missing from the loaded `tables`."""
+    missing = ['{}.{}'.format(name, col) for name, cols in schema(dataset).items()
+               for col in cols if col not in tables[name]]
+    if missing:
+        raise ValueError('dataset {!r} is missing {}'.format(dataset.name, ', '.join(missing)))
@@ -0,0 +1,138 @@
+# -*- coding: utf-8 -*-
+"""
+Multi-process launcher of the bokeh server.
+
+Loads everything first (app_hooks.preload), then forks `--num-procs` workers (default:
+the number of cores), each running `bokeh serve` on its own port on 127.0.0.1
+(`--worker-port` + i). The workers are forked with the data already in memory: the
+memory-mapped tables and the precomputed frames are shared copy-on-write by all of them,
+and their on_server_loaded only finds warm caches.
+
+The parent process listens on `--port` (default 5006) and relays requests to the
+workers with sticky sessions (front.py): the page request and the websocket of a session
+always reach the same worker, which builds its document once. Behind another reverse
+proxy, point it at this port. With a single worker, bokeh serve listens on `--port`
+directly. Every other argument is passed on to `bokeh serve`; without any
+--allow-websocket-origin, the workers accept websockets from localhost:<port>.
+
+A worker that fails (non-zero exit) after running `min_uptime_s` is restarted on its port,
+as a new `bokeh serve` process that loads the data itself; one that fails sooner stops the
+whole server, for the process supervisor to restart. The server exits when every worker
+has exited (e.g. drained, see lifecycle.py), with the highest exit code of the workers;
+SIGTERM and SIGINT are passed on to them.
+
+Usage:
+    python serve.py                                   # one worker per core on port 5006
+    python serve.py --num-procs 4 --allow-websocket-origin=example.org
+
+"""
+
+# imports
+import argparse
+import logging
+import os
+import signal
+import subprocess
+import sys
+import time
+import tornado.ioloop
+from bokeh.command.bootstrap import main
+import app_hooks
+import front
+import instrument
+
+here = os.path.dirname(os.path.abspath(__file__))
+log = logging.getLogger(__name__)
+# a worker failing after running this long (s) is restarted, sooner the server stops
+min_uptime_s = 30
+# the restarted workers
+restarted = []
+
+
+def start_worker(i, port, args):
+    """Fork worker `i`, running bokeh serve on `port`; its pid."""
+    pid = os.fork()
+    if pid:
+        return pid
+    os.environ['EW_WORKER'] = str(i)
+    # the data was loaded by the parent, not by this worker
+    instrument.metrics.clear()
+    code = 0
+    try:
+        main(['bokeh', 'serve', here, '--port', str(port), '--address', '127.0.0.1'] + args)
+    except SystemExit as e:
+        code = e.code if isinstance(e.code, int) else 1
+    except BaseException:
+        code = 1
+    finally:
+        os._exit(code)
+
+def restart_worker(i, port, args):
+    """Start worker `i` again, as a new process (forking the front would hand it the
+    front's sockets); its pid."""
+    env = dict(os.environ, EW_WORKER=str(i))
+    cmd = [sys.executable, '-m', 'bokeh', 'serve', here, '--port', str(port), '--address', '127.0.0.1'] + args
+    process = subprocess.Popen(cmd, env=env)
+    # keep a reference: subprocess would otherwise reap it behind run_front's back
+    restarted.append(process)
+    return process.pid
+
+def run_front(port, address, ports, args, pids):
+    """Relay `port` to the workers on `ports` (running bokeh serve `args`, as the processes
+    `pids`) until every worker has exited; the highest exit code."""
+    loop = tornado.ioloop.IOLoop.current()
+    running = {pid: (i, time.monotonic()) for i, pid in enumerate(pids)}
+    codes = []
+    stopping = False
+
+    def stop_workers(*_):
+        nonlocal stopping
+        stopping = True
+        for pid in running:
+            os.kill(pid, signal.SIGTERM)
+
+    def reap():
+        for pid, (i, started) in list(running.items()):
+            done, status = os.waitpid(pid, os.WNOHANG)
+            if not done:
+                continue
+            del running[pid]
+            code = os.waitstatus_to_exitcode(status)
+            if code and not stopping and time.monotonic() - started >= min_uptime_s:
+                log.warning('worker %d exited with code %d, restarting it', i, code)
+                running[restart_worker(i, ports[i], args)] = i, time.monotonic()
+                continue
+            codes.append(code)
+            if code and not stopping:
+                log.warning('worker %d exited with code %d, stopping the server', i, code)
+                stop_workers()
+        if not running:
+            loop.stop()
+
+    signal.signal(signal.SIGTERM, stop_workers)
+    signal.signal(signal.SIGINT, stop_workers)
+    workers = ['127.0.0.1:{}'.format(p) for p in ports]
+    front.application(workers, '/' + os.path.basename(here)).listen(port, address=address or '')
+    tornado.ioloop.PeriodicCallback(reap, 200).start()
+    loop.start()
+    return max(abs(code) for code in codes)
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Serve the dashboard from several worker processes.')
+    parser.add_argument('--num-procs', type=int, default=os.cpu_count() or 1)
+    parser.add_argument('--port', type=int, default=5006)
+    parser.add_argument('--address', help='address of the front (default: all interfaces)')
+    parser.add_argument('--worker-port', type=int, default=5100, help='port of the first worker')
+    args, rest = parser.parse_known_args()
+    app_hooks.preload()
+    if args.num_procs <= 1:
+        address = ['--address', args.address] if args.address else []
+        main(['bokeh', 'serve', here, '--port', str(args.port)] + address + rest)
+        raise SystemExit(0)
+
+    if not any(arg.split('=')[0] == '--allow-websocket-origin' for arg in rest):
+        rest = rest + ['--allow-websocket-origin', 'localhost:{}'.format(args.port)]
+    ports = [args.worker_port + i for i in range(args.num_procs)]
+    pids = [start_worker(i, port, rest) for i, port in enumerate(ports)]
+    sys.exit(run_front(args.port, args.address, ports, rest, pids))
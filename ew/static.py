@@ -0,0 +1,76 @@
+# -*- coding: utf-8 -*-
+"""
+Static, server-less export of the dashboard (`python main.py --static`).
+
+Builds every tab eagerly and writes:
+    index.html      self-contained page (bokeh.embed.file_html, minified BokehJS from the CDN)
+    dashboard.json  the document as a compact json_item, for Bokeh.embed.embed_item
+plus gzip (and brotli, if the brotli package is installed) variants of both, so that a
+CDN can serve them precompressed with no server CPU per visitor.
+
+Each model is emitted once in the document and referenced by id wherever it is used, so
+the figures of a tab share their ColumnDataSource; the build fails if two distinct
+sources carry identical data.
+
+"""
+
+# imports
+import gzip
+import hashlib
+import json
+import os
+from bokeh.embed import file_html, json_item
+from bokeh.models import ColumnDataSource
+from bokeh.resources import CDN
+import numpy as np
+import dashboard
+
+try:
+    import brotli
+except ImportError:
+    brotli = None
+
+
+def duplicate_sources(root):
+    """Groups of distinct ColumnDataSources under `root` that hold the same data."""
+    groups = {}
+    for model in root.references():
+        if isinstance(model, ColumnDataSource):
+            h = hashlib.sha256()
+            for col in sorted(model.data):
+                h.update(col.encode('utf-8'))
+                h.update(np.asarray(model.data[col]).tobytes())
+            groups.setdefault(h.hexdigest(), []).append(model)
+    return [g for g in groups.values() if len(g) > 1]
+
+def write(path, text):
+    """Write `text` and its precompressed variants; return {variant: bytes}."""
+    data = text.encode('utf-8')
+    variants = {'': data, '.gz': gzip.compress(data, compresslevel=9, mtime=0)}
+    if brotli is not None:
+        variants['.br'] = brotli.compress(data, quality=11)
+    for ext, payload in variants.items():
+        with open(path + ext, 'wb') as f:
+            f.write(payload)
+    return {ext or 'raw': len(payload) for ext, payload in variants.items()}
+
+def build(out):
+    """Export the dashboard to the directory `out`; return the sizes of the files written.
+    The page and the json item serialize the same (checked) layout."""
+    os.makedirs(out, exist_ok=True)
+    layout = dashboard.layout(lazy=False, server=False)
+    duplicates = duplicate_sources(layout)
+    if duplicates:
+        raise ValueError('{} groups of ColumnDataSources with identical data: {}'.format(
+            len(duplicates), [[s.id for s in g] for g in duplicates]))
+    sizes = {}
+    sizes['index.html'] = write(os.path.join(out, 'index.html'), file_html(layout, CDN, dashboard.title))
+    item = json_item(layout, 'enchanted-wanderer')
+    sizes['dashboard.json'] = write(os.path.join(out, 'dashboard.json'), json.dumps(item, separators=(',', ':')))
+    return sizes
+
+def report(sizes):
+    variants = ['raw', '.gz', '.br']
+    print('{:<18}'.format('') + ''.join('{:>12}'.format(v) for v in variants))
+    for name, s in sizes.items():
+        print('{:<18}'.format(name) + ''.join('{:>12}'.format('{:,}'.format(s[v]) if v in s else '-') for v in variants))